@@ -1,12 +1,12 @@
 import os
 import pickle
 import re
-import time
-from pathlib import Path
 
 from filelock import FileLock
 
 import tiq.library.wikipedia_library as wiki
+from tiq.library.append_only_store import AppendOnlyStore
+from tiq.library.tracing import get_tracer
 from tiq.library.utils import get_logger, format_text
 
 ENT_PATTERN = re.compile("^Q[0-9]+$")
@@ -32,6 +32,7 @@ class InformationRetriever:
 
         self.config = config
         self.logger = get_logger(__name__, config)
+        self.tracer = get_tracer(config)
         self.wp_retriever = wp_retriever
         self.clocq = self.wp_retriever.clocq
 
@@ -49,13 +50,15 @@ class InformationRetriever:
         if self.use_cache:
             # initialize cache
             self._init_information_snippet_dump()
-            self.dump_changed = False
 
-        self.entity_type_map = {}
+        self.entity_metadata = self.wp_retriever.entity_metadata
 
     def retrieve_info_wikidata(self, entity):
         qualifier_temporal_evidences, main_temporal_facts = self.retrieve_kb_facts(entity)
         evidences = qualifier_temporal_evidences + main_temporal_facts
+        # look up the types of all entities at once
+        self.entity_metadata.get_type_bulk(
+            [item["id"] for evidence in evidences for item in evidence["wikidata_entities"]])
         for evidence in evidences:
             self.add_type_to_entity(evidence)
             answer_entity = []
@@ -162,31 +165,23 @@ class InformationRetriever:
 
     def add_type_to_entity(self, evidence):
         for item in evidence["wikidata_entities"]:
-            if item["id"] in self.entity_type_map:
-                type = self.entity_type_map[item["id"]]
-                if type:
-                    item["type"] = type["label"]
-                else:
-                    item["type"] = "NULL"
+            type = self.entity_metadata.get_type(item["id"])
+            if type:
+                item["type"] = type["label"]
             else:
-                type = self.clocq.get_type(item["id"])
-                self.entity_type_map[item["id"]] = type
-                if type:
-                    item["type"] = type["label"]
-                else:
-                    item["type"] = "NULL"
+                item["type"] = "NULL"
 
     def retrieve_kb_facts(self, entity):
         """Retrieve evidences from KB for the given item (used in DS)."""
         entity_id = entity["id"]
-        if self.use_cache and entity_id in self.information_dump:
+        facts = self.information_dump.get(entity_id) if self.use_cache else None
+        if facts is not None:
             self.logger.debug(f"Found Information snippets in dump!")
-            facts = self.information_dump.get(entity_id)
         else:
-            facts = self.clocq.get_neighborhood(entity_id, p=self.config["clocq_p"], include_labels=True)
-            if self.use_cache and entity_id not in self.information_dump:
+            with self.tracer.span("clocq", call="neighborhood"):
+                facts = self.clocq.get_neighborhood(entity_id, p=self.config["clocq_p"], include_labels=True)
+            if self.use_cache:
                 self.information_dump[entity_id] = facts
-                self.dump_changed = True
 
         self.logger.debug(f"Number of facts : {len(facts)}")
         temporal_facts = []
@@ -585,82 +580,43 @@ class InformationRetriever:
 
     def _init_information_snippet_dump(self):
         """
-        Initialize the Wikipedia dump. The consists of a mapping
-        from Wikidata IDs to Wikipedia evidences in the expected format.
+        Initialize the KB Information snippet dump, a mapping from Wikidata IDs
+        to KB facts. The dump is an append-only file shared across processes:
+        only the index (Wikidata ID -> file offset) is loaded on startup.
         """
-        if os.path.isfile(self.path_to_dump):
-            # remember version read initially
-            self.logger.info(f"Loading KB Information snippet dump from path {self.path_to_dump}.")
-            with FileLock(f"{self.path_to_dump}.lock"):
-                self.dump_version = self._read_dump_version()
-                self.logger.info(f"Dump version {self.dump_version}.")
-                self.information_dump = self._read_dump()
-            self.logger.info(f"KB Information snippet successfully loaded.")
-        else:
-            self.logger.info(
-                f"Could not find an existing KB Information snippet at path {self.path_to_dump}."
-            )
-            self.logger.info("Populating KB Information snippet from scratch!")
-            self.information_dump = {}
-            self._write_dump(self.information_dump)
-            self._write_dump_version()
+        self.logger.info(f"Loading KB Information snippet dump index from path {self.path_to_dump}.")
+        self.information_dump = AppendOnlyStore(self.path_to_dump,
+                                                flush_size=self.config["temporal_fact_dump_flush_size"],
+                                                compaction_ratio=self.config["temporal_fact_dump_compaction_ratio"])
+        self._migrate_pickle_dump()
+        self.logger.info(f"KB Information snippet dump index successfully loaded.")
+
+    def _migrate_pickle_dump(self):
+        """
+        Import the entries of a KB Information snippet dump of earlier versions (pickled dictionary) once.
+        Entries already in the dump are kept. The pickle file is renamed afterwards.
+        """
+        path_to_pickle_dump = os.path.join(self.data_path, self.config["temporal_fact_pickle_dump_file"])
+        if not os.path.isfile(path_to_pickle_dump):
+            return
+        # the lock of the dump itself is taken when appending the entries
+        with FileLock(f"{path_to_pickle_dump}.lock"):
+            # another process might have migrated the dump in the meantime
+            if not os.path.isfile(path_to_pickle_dump):
+                return
+            self.logger.info(f"Importing KB Information snippet dump from path {path_to_pickle_dump}.")
+            with open(path_to_pickle_dump, "rb") as fp:
+                pickle_dump = pickle.load(fp)
+            for entity_id, facts in pickle_dump.items():
+                if entity_id not in self.information_dump:
+                    self.information_dump.put(entity_id, facts)
+            self.information_dump.flush()
+            os.replace(path_to_pickle_dump, f"{path_to_pickle_dump}.migrated")
+            self.logger.info(f"Imported {len(pickle_dump)} entries, the pickle file was renamed.")
 
     def store_dump(self):
-        """Store the Wikipedia dumo to disk."""
-        if not self.use_cache:  # store only if Wikipedia dump in use
-            return
-        if not self.dump_changed:  # store only if Wikipedia dump  changed
+        """Append the new entries of the KB Information snippet dump to disk."""
+        if not self.use_cache:  # store only if dump in use
             return
-        # check if the Wikipedia dump  was updated by other processes
-        if self._read_dump_version() == self.dump_version:
-            # no updates: store and update version
-            self.logger.info(f"Writing KB Information snippet at path {self.path_to_dump}.")
-            with FileLock(f"{self.path_to_dump}.lock"):
-                self._write_dump(self.information_dump)
-                self._write_dump_version()
-        else:
-            # update! read updated version and merge the dumps
-            self.logger.info(f"Merging KB Information snippet at path {self.path_to_dump}.")
-            with FileLock(f"{self.path_to_dump}.lock"):
-                # read updated version
-                updated_dump = self._read_dump()
-                # overwrite with changes in current process (most recent)
-                updated_dump.update(self.information_dump)
-                # store
-                self._write_dump(updated_dump)
-                self._write_dump_version()
-
-    def _read_dump(self):
-        """
-        Read the current version of the dump.
-        This can be different from the version used in this file,
-        given that multiple processes may access it simultaneously.
-        """
-        # read file content from wikipedia dump shared across QU methods
-        self.logger.info(f"Start read KB Information snippet dump {self.path_to_dump}.")
-        with open(self.path_to_dump, "rb") as fp:
-            information_dump = pickle.load(fp)
-        return information_dump
-
-    def _write_dump(self, dump):
-        """Store the dump."""
-        dump_dir = os.path.dirname(self.path_to_dump)
-        Path(dump_dir).mkdir(parents=True, exist_ok=True)
-        with open(self.path_to_dump, "wb") as fp:
-            pickle.dump(dump, fp)
-        return dump
-
-    def _read_dump_version(self):
-        """Read the dump version (hashed timestamp of last update) from a dedicated file."""
-        if not os.path.isfile(f"{self.path_to_dump}.version"):
-            self._write_dump_version()
-        with open(f"{self.path_to_dump}.version", "r") as fp:
-            dump_version = fp.readline().strip()
-        return dump_version
-
-    def _write_dump_version(self):
-        """Write the current dump version (hashed timestamp of current update)."""
-        with open(f"{self.path_to_dump}.version", "w") as fp:
-            version = str(time.time())
-            fp.write(version)
-        self.dump_version = version
+        self.logger.info(f"Writing KB Information snippet at path {self.path_to_dump}.")
+        self.information_dump.flush()
@@ -0,0 +1,50 @@
+"""
+Matcher for the anchor texts of a Wikipedia page.
+Finds all anchor texts occurring in a text in one pass over the text,
+instead of one substring search per anchor text.
+"""
+
+# anchor texts are indexed by their first characters
+PREFIX_LENGTH = 3
+
+
+class AnchorMatcher:
+    def __init__(self, anchors=()):
+        # anchor text -> rank (order in which anchor texts were added)
+        self.rank = dict()
+        # first characters -> anchor texts
+        # (anchor texts shorter than PREFIX_LENGTH are indexed by the full text)
+        self.anchors_by_prefix = dict()
+        self.lengths = [PREFIX_LENGTH]
+        for anchor in anchors:
+            self.add(anchor)
+
+    def add(self, anchor):
+        if anchor in self.rank:
+            return
+        self.rank[anchor] = len(self.rank)
+        prefix = anchor[:PREFIX_LENGTH]
+        if len(prefix) not in self.lengths:
+            self.lengths = sorted(self.lengths + [len(prefix)])
+        self.anchors_by_prefix.setdefault(prefix, []).append(anchor)
+
+    def find(self, text):
+        """
+        Returns a dictionary from the anchor texts occurring in the given text
+        to the start of their first occurrence.
+        """
+        found = dict()
+        anchors_by_prefix = self.anchors_by_prefix
+        for start in range(len(text)):
+            for length in self.lengths:
+                candidates = anchors_by_prefix.get(text[start:start + length])
+                if not candidates:
+                    continue
+                for anchor in candidates:
+                    if anchor not in found and text.startswith(anchor, start):
+                        found[anchor] = start
+        return found
+
+    def sorted_by_rank(self, anchors):
+        """Sort the given anchor texts in the order in which they were added."""
+        return sorted(anchors, key=self.rank.get)
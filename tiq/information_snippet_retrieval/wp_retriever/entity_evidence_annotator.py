@@ -1,14 +1,18 @@
-import json
 import logging
 import os
 import pickle
+import threading
+import time
 import traceback
+from bisect import bisect_right
 
-import requests
+from filelock import FileLock
 
 import tiq.library.wikipedia_library as wiki
+from tiq.information_snippet_retrieval.wp_retriever.anchor_matcher import AnchorMatcher
+from tiq.library.sqlite_store import SqliteStore
 from tiq.library.string_library import StringLibrary as string_lib
-from tiq.library.utils import get_qid
+from tiq.library.utils import get_logger, get_qid
 
 MAX_WIKI_PATHS_PER_REQ = 50
 
@@ -22,21 +26,31 @@ class EvidenceAnnotator:
     Annotate evidences with entities, dates and potentially other constants.
     """
 
-    def __init__(self, config, temporal_expression, wikidata_mappings):
+    def __init__(self, config, temporal_expression, wikidata_mappings, page_source):
         self.config = config
+        self.logger = get_logger(__name__, config)
         self.wikidata_mappings = wikidata_mappings
         self.date_annotation = temporal_expression.date_ordinal_annotator
         self.temporal_expression_ann = temporal_expression
         self.reference_time = self.config["reference_time"]
         self.date_tag_method = "regex"
+        # evidences without dates have no timespan, and are dropped in the evidence selection:
+        # such evidences are not processed by spaCy
+        self.require_dates = self.config["temporal_annotation_require_dates"]
         # load Wikidata labels
         with open(os.path.join(self.config["data_path"], self.config["path_to_labels"]), "rb") as fp:
             self.labels_dict = pickle.load(fp)
 
         # initialize cache
         self.path = os.path.join(self.config["data_path"], config["path_to_cache_wikipedia_to_wikidata"])
+        # Wikipedia paths without redirect are looked up again after this time
+        self.redirect_miss_ttl = self.config["redirect_miss_ttl_days"] * 24 * 3600
         self.label_not_in_dictionary = []
+        # the cache is shared by threads annotating different pages
+        self.cache_lock = threading.Lock()
         self._init_cache()
+        # source for Wikipedia redirects (live Wikipedia or local archive)
+        self.page_source = page_source
 
     def annotate_wikidata_events(self, wiki_path, doc_anchor_dict):
         doc_anchor_tuples = [(key, value) for key, value in doc_anchor_dict.items()]
@@ -74,15 +88,14 @@ class EvidenceAnnotator:
         """
         Add Wikidata entities, dates and potentially other constants to evidences.
         """
-        # sort anchor-texts by their length
-        doc_anchor_tuples = [(key, value) for key, value in doc_anchor_dict.items()]
-        doc_anchor_tuples = sorted(doc_anchor_tuples, key=lambda y: len(y[0]), reverse=True)
+        # anchor-texts of the page are matched in one pass per evidence
+        anchor_matcher = AnchorMatcher(doc_anchor_dict)
 
         for evidence in evidences:
             # detect wikipedia entities
             if not evidence.get("source") == "info":  # entities for infobox are already done
                 wiki_paths, disambiguations = self._detect_wikipedia_entities(
-                    wiki_path, evidence, doc_anchor_tuples
+                    wiki_path, evidence, doc_anchor_dict, anchor_matcher
                 )
                 evidence["wikipedia_paths"] = wiki_paths
                 evidence["wp_disambiguations"] = disambiguations
@@ -101,8 +114,13 @@ class EvidenceAnnotator:
             evidence["wikidata_ids"] = [page_entity_id]
             evidence["disambiguations"] = [(wiki_title, page_entity_id)]
 
-            annotation_result, explicit_expression, date_annotator_result, _ = self.temporal_expression_ann.annotateExplicitTemporalExpressions(
-                evidence["evidence_text"], self.config["reference_time"], self.date_tag_method)
+        # temporal annotation of all evidences of the page in one batch
+        temporal_annotations = self.temporal_expression_ann.annotateExplicitTemporalExpressionsBatch(
+            [evidence["evidence_text"] for evidence in evidences], self.config["reference_time"],
+            self.date_tag_method, require_dates=self.require_dates)
+
+        for evidence, temporal_annotation in zip(evidences, temporal_annotations):
+            annotation_result, explicit_expression, date_annotator_result, _ = temporal_annotation
 
             evidence["explicit_expression"] = explicit_expression
 
@@ -166,44 +184,48 @@ class EvidenceAnnotator:
             del evidence["wikipedia_paths"]
             del evidence["wp_disambiguations"]
 
-    def _detect_wikipedia_entities(self, wiki_path, evidence, doc_anchor_tuples):
+    def _detect_wikipedia_entities(self, wiki_path, evidence, doc_anchor_dict, anchor_matcher):
         """
         Identify Wikipedia entities in the given evidence using
         the given anchor dict for the Wikipedia page.
         Longer matches would be checked first.
         """
         # remember all anchor texts for prunings
-        finds = list()
+        # (start and end positions of the matches, sorted by start)
+        find_starts = list()
+        find_ends = list()
         disambiguations = list()
         evidence_text = evidence["evidence_text"]
 
         wikipedia_paths = list()
-        for anchor_text, anchor_path in doc_anchor_tuples:
-            if anchor_text in evidence_text:
-                ## do not consider wiki_paths with hashtags
-                # hashtag indicates a paragraph on entity, rather than entity
-                if "#" in anchor_path:
-                    continue
-
-                # search start and end points
-                new_start = evidence_text.find(anchor_text)
-                new_end = new_start + len(anchor_text)
-
-                ## detect duplicate match for substring
-                # positions must be inside range of [_start,_end]
-                # since anchor texts are sorted by length
-                duplicate = False
-                for _start, _end in finds:
-                    if new_start >= _start and new_start <= _end:
-                        duplicate = True
-                    elif new_end >= _start and new_end <= _end:
-                        duplicate = True
-
-                # if no duplicate match found -> new anchor
-                if not duplicate:
-                    finds.append((new_start, new_end))
-                    wikipedia_paths.append(anchor_path)
-                    disambiguations.append((anchor_text, anchor_path))
+        # first occurrences of the anchor texts in the evidence
+        matches = anchor_matcher.find(evidence_text)
+        # sort anchor-texts by their length
+        anchor_texts = sorted(anchor_matcher.sorted_by_rank(matches), key=len, reverse=True)
+        for anchor_text in anchor_texts:
+            anchor_path = doc_anchor_dict[anchor_text]
+            ## do not consider wiki_paths with hashtags
+            # hashtag indicates a paragraph on entity, rather than entity
+            if "#" in anchor_path:
+                continue
+
+            # start and end points
+            new_start = matches[anchor_text]
+            new_end = new_start + len(anchor_text)
+
+            ## detect duplicate match for substring
+            # positions must not be inside range of [_start,_end] of an earlier match
+            # since anchor texts are sorted by length, and earlier matches do not overlap,
+            # only the last match starting before new_end needs to be checked
+            index = bisect_right(find_starts, new_end)
+            if index and find_ends[index - 1] >= new_start:
+                continue
+
+            # if no duplicate match found -> new anchor
+            find_starts.insert(index, new_start)
+            find_ends.insert(index, new_end)
+            wikipedia_paths.append(anchor_path)
+            disambiguations.append((anchor_text, anchor_path))
 
         # add path of Wikipedia page entity
         if not wiki_path in wikipedia_paths:
@@ -215,7 +237,7 @@ class EvidenceAnnotator:
 
     def _extract_dates_multithread(self, evidence_texts):
         """
-        Extract dates in texts with multithread (added to entities).
+        Extract dates in texts with worker processes (added to entities).
         First, text is searched for text, then the dates
         are brought into a compatible format (timestamps).
         """
@@ -223,7 +245,8 @@ class EvidenceAnnotator:
 
         evidence_texts_dates = list()
 
-        date_annotation_results = self.date_annotation.date_annotator_multithread(evidence_texts, self.date_tag_method)
+        date_annotation_results = self.temporal_expression_ann.temporal_value_annotator.date_annotator_batch(
+            evidence_texts, self.reference_time, self.date_tag_method)
         # # detect dates, ordinals, and signals
         for evidence_result in date_annotation_results:
             dates = list()
@@ -273,6 +296,7 @@ class EvidenceAnnotator:
             return self.cache[wiki_path]
 
         # try look-up
+        via_redirect = False
         if self.wikidata_mappings.get(wiki_path):
             wikidata_id = self.wikidata_mappings.get(wiki_path)
         elif self.wikidata_mappings.get(wiki_path.replace(".", "")):
@@ -280,10 +304,11 @@ class EvidenceAnnotator:
         # try via redirect look-up
         elif redirects.get(wiki_path):
             wiki_title = redirects.get(wiki_path)
-            wiki_path = wiki._wiki_title_to_path(wiki_title)
+            target_path = wiki._wiki_title_to_path(wiki_title)
             # try via dict
-            if self.wikidata_mappings.get(wiki_path):
-                wikidata_id = self.wikidata_mappings.get(wiki_path)
+            if self.wikidata_mappings.get(target_path):
+                wikidata_id = self.wikidata_mappings.get(target_path)
+                via_redirect = True
                 # -> different from None return value
             else:
                 # self.qid_not_in_dictionary.append(wiki_path)
@@ -292,17 +317,23 @@ class EvidenceAnnotator:
             # self.qid_not_in_dictionary.append(wiki_path)
             return None
 
-        self.cache[wiki_path] = wikidata_id
+        with self.cache_lock:
+            if wiki_path not in self.cache:
+                self.cache[wiki_path] = wikidata_id
+                # direct look-ups are cheap, only mappings found via redirects are stored
+                # (under the path that required the redirect)
+                if via_redirect:
+                    self.wikidata_id_store[wiki_path] = wikidata_id
         return wikidata_id
 
     def extract_redirects(self, wiki_paths):
         """
         Extract redirects for set of Wikipedia paths (one entity can have multiple paths).
-        Makes use of _extract_redirects_for_50 function to decrease number
-        of requests required.
+        Redirects (and paths without redirect) are remembered in the redirect store,
+        the remaining paths are resolved in requests of 50 paths via _extract_redirects_for_50.
         """
 
-        wiki_paths = list(set(wiki_paths))
+        wiki_paths = list(dict.fromkeys(wiki_paths))
 
         # drop wiki_paths for which Wikidata mapping is already known (redirect not required)
         wiki_paths = [
@@ -311,81 +342,81 @@ class EvidenceAnnotator:
             if wiki_path and self._wiki_path_to_wikidata(wiki_path, {}) is None
         ]
 
-        # limit for wiki_paths per request is 50
-        start_index = 0
+        # look up known redirects
         redirects = dict()
-        while start_index < len(wiki_paths):
-            end_index = min(start_index + MAX_WIKI_PATHS_PER_REQ, len(wiki_paths) - 1)
-            wiki_paths_batch = wiki_paths[start_index:end_index]
+        unresolved = list()
+        now = time.time()
+        for wiki_path in wiki_paths:
+            entry = self.redirect_store.get(wiki_path)
+            if entry is None:
+                unresolved.append(wiki_path)
+                continue
+            redirect, timestamp = entry
+            if redirect:
+                redirects[wiki_path] = redirect
+            elif now - timestamp > self.redirect_miss_ttl:
+                unresolved.append(wiki_path)
+
+        # limit for wiki_paths per request is 50
+        for start_index in range(0, len(unresolved), MAX_WIKI_PATHS_PER_REQ):
+            wiki_paths_batch = unresolved[start_index:start_index + MAX_WIKI_PATHS_PER_REQ]
             new_redirects = self._extract_redirects_for_50(wiki_paths_batch)
+            if new_redirects is None:
+                # request failed: try again next time
+                continue
             redirects.update(new_redirects)
-            start_index += MAX_WIKI_PATHS_PER_REQ
+            self.redirect_store.put_many(
+                [(wiki_path, (new_redirects.get(wiki_path), now)) for wiki_path in wiki_paths_batch])
         return redirects
 
     def _extract_redirects_for_50(self, wiki_paths):
         """
         Extract redirects of given (max.) 50 Wikipedia paths (one entity can have multiple paths).
         Used in extract_redirects function for efficiency.
+        Returns None if the redirects could not be retrieved.
         """
         if not wiki_paths:
             return {}
 
-        # initialize
-        redirects = dict()
-
         try:
-            # create request url
-            wiki_paths_string = "|".join(wiki_paths)
-            url = f"https://en.wikipedia.org/w/api.php?action=query&format=json&titles={wiki_paths_string}&redirects"
-
-            # retrieve result
-            res = requests.get(url)
-            res_dict = json.loads(res.content)
-
-            ## result has mappings:
-            #   normalized: wiki_path -> wiki_title
-            #   redirects: wiki_title -> redirected wiki_title
-            if res_dict["query"].get("normalized"):
-                normalized = {
-                    normalized["to"]: normalized["from"]
-                    for normalized in res_dict["query"]["normalized"]
-                }
-            else:
-                normalized = dict()
-
-            # if redirects not set, no redirects required!
-            if not res_dict["query"].get("redirects"):
-                return redirects
-
-            # create redirects dict
-            for redirect in res_dict["query"]["redirects"]:
-                # get key
-                if normalized.get(redirect["from"]):
-                    key = normalized[redirect["from"]]
-                else:
-                    key = redirect["from"]
-
-                # add entry
-                redirects[key] = redirect["to"]
+            return self.page_source.get_redirects(wiki_paths)
 
         # catch exception and log problem
         except Exception as e:
-            print(f"Error catched for url: {url}")
+            print(f"Error catched for Wikipedia paths: {wiki_paths}")
             print(e)
             if hasattr(e, "__traceback__"):
                 traceback.print_tb(e.__traceback__)
-
-        return redirects
-
-    def store_cache(self):
-        """Store the cache to disk."""
-        with open(self.path, "wb") as fp:
-            pickle.dump(self.cache, fp)
+            return None
 
     def _init_cache(self):
-        """Initialize the cache."""
-        if os.path.isfile(self.path):
-            with open(self.path, "rb") as fp:
-                self.cache = pickle.load(fp)
-        else:
-            self.cache = dict()
+        """
+        Initialize the cache. The Wikipedia path -> Wikidata ID mappings and the redirects
+        are kept in an SQLite store, which can be shared by multiple processes.
+        """
+        self.wikidata_id_store = SqliteStore(self.path, table="wikidata_ids")
+        self.redirect_store = SqliteStore(self.path, table="redirects")
+        self._migrate_pickle_cache()
+        self.cache = dict(self.wikidata_id_store.items())
+
+    def _migrate_pickle_cache(self):
+        """
+        Import the Wikipedia path -> Wikidata ID mappings of earlier versions (pickled dictionary,
+        part of the downloaded data) once. Mappings already in the store are kept.
+        The pickle file is renamed afterwards.
+        """
+        path_to_pickle_cache = os.path.join(self.config["data_path"],
+                                            self.config["path_to_pickle_cache_wikipedia_to_wikidata"])
+        if not os.path.isfile(path_to_pickle_cache):
+            return
+        with FileLock(f"{self.path}.lock"):
+            # another process might have migrated the mappings in the meantime
+            if not os.path.isfile(path_to_pickle_cache):
+                return
+            self.logger.info(f"Importing Wikipedia path -> Wikidata ID mappings from path {path_to_pickle_cache}.")
+            with open(path_to_pickle_cache, "rb") as fp:
+                pickle_cache = pickle.load(fp)
+            self.wikidata_id_store.put_many((wiki_path, wikidata_id) for wiki_path, wikidata_id in pickle_cache.items()
+                                            if wiki_path not in self.wikidata_id_store)
+            os.replace(path_to_pickle_cache, f"{path_to_pickle_cache}.migrated")
+            self.logger.info(f"Imported {len(pickle_cache)} mappings, the pickle file was renamed.")
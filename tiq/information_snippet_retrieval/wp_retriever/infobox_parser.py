@@ -2,13 +2,21 @@
 Infobox parser for Wikipedia tables.
 Inspired by https://github.com/roskoff/HTMLTableParser/blob/master/HTMLTableParser.py.
 """
+import re
 from html.parser import HTMLParser
 
 import tiq.library.wikipedia_library as wiki
+from tiq.information_snippet_retrieval.wp_retriever.anchor_matcher import AnchorMatcher
+from tiq.information_snippet_retrieval.wp_retriever.page_parser import soup_string
 
 CELL_SEPARATOR = ", "
 COMPONENT_SEPARATOR = ", "
 
+# characters escaped as entity references in serialized html (the parser skips entity references)
+ESCAPED_CHARS_PATTERN = re.compile(r"[&<>]")
+# elements whose content is passed to the parser unescaped
+RAW_TEXT_TAGS = {"script", "style"}
+
 
 def infobox_to_evidences(parsed_infobox, wiki_title):
     """
@@ -95,6 +103,33 @@ class InfoboxParser(HTMLParser):
         # multiple mentions of same entity are not all tagged with URL
         # -> remember such entities (phrase->entity entries)
         self.anchor_dict = anchor_dict
+        self.anchor_matcher = AnchorMatcher(anchor_dict)
+
+    def feed_element(self, element):
+        """
+        Parse the given lxml element (see page_parser) directly,
+        without serializing it to html and tokenizing it again.
+        The handlers are called in the same way as by feed for the serialized element.
+        """
+        self.handle_starttag(element.tag, list(element.attrib.items()))
+        if element.text:
+            self._feed_text(element.tag, element.text)
+        for child in element:
+            # comments have no string tag
+            if isinstance(child.tag, str):
+                self.feed_element(child)
+            if child.tail:
+                self._feed_text(element.tag, child.tail)
+        self.handle_endtag(element.tag)
+
+    def _feed_text(self, tag, text):
+        text = soup_string(text)
+        if tag in RAW_TEXT_TAGS:
+            self.handle_data(text)
+            return
+        for data in ESCAPED_CHARS_PATTERN.split(text):
+            if data:
+                self.handle_data(data)
 
     def get_anchor_dict(self):
         return self.anchor_dict
@@ -124,6 +159,7 @@ class InfoboxParser(HTMLParser):
         if self._after_href:
             # store data->entity in dicts
             self.anchor_dict[data] = self._last_href
+            self.anchor_matcher.add(data)
             if wiki.is_wikipedia_path(self._last_href):
                 self._current_cell["anchor_dict"][data] = self._last_href
             # delete flag
@@ -148,11 +184,11 @@ class InfoboxParser(HTMLParser):
             cell_entities = self._current_cell["entities"]
             cell_anchor_dict = self._current_cell["anchor_dict"]
             if not cell_entities:
-                for anchor in self.anchor_dict:
-                    if anchor in cell_text:
-                        anchor_entity = self.anchor_dict[anchor]
-                        cell_entities.append(anchor_entity)
-                        cell_anchor_dict[anchor] = anchor_entity
+                matches = self.anchor_matcher.find(cell_text)
+                for anchor in self.anchor_matcher.sorted_by_rank(matches):
+                    anchor_entity = self.anchor_dict[anchor]
+                    cell_entities.append(anchor_entity)
+                    cell_anchor_dict[anchor] = anchor_entity
             cell_type = "data" if tag == "td" else "header"
             final_cell = {
                 "entities": cell_entities,
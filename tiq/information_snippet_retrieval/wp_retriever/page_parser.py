@@ -0,0 +1,98 @@
+"""
+Parser for Wikipedia html pages, built on lxml (libxml2).
+A page is parsed once, and a single walk through the tree collects
+everything needed for the retrieval of evidences:
+- the anchor dict (anchor text -> Wikipedia path) of the page,
+- the anchor dict for event pages (any link, not only Wikipedia paths),
+- the first infobox table (parsed with InfoboxParser.feed_element),
+- the content element (for deriving the plain text, see text_parser).
+Navigation bars (navbox) are ignored.
+"""
+import lxml.html
+
+import tiq.library.wikipedia_library as wiki
+
+# the text of these elements is not part of anchor texts
+RAW_TEXT_TAGS = {"script", "style"}
+ASCII_SPACES = " \n\t\f\r"
+
+
+class ParsedPage:
+    def __init__(self):
+        self.anchor_dict = dict()
+        self.event_anchor_dict = dict()
+        self.infobox = None
+        self.content = None
+
+
+def parse_page(html):
+    """
+    Parse the given html of a Wikipedia page.
+    Returns None if the html could not be parsed.
+    """
+    if not html:
+        return None
+    try:
+        root = lxml.html.document_fromstring(html)
+    except Exception:
+        return None
+    page = ParsedPage()
+    _walk(root, page)
+    return page
+
+
+def element_text(element):
+    """Text of the element and its descendants (like the text of a soup tag)."""
+    texts = [soup_string(element.text)] if element.tag not in RAW_TEXT_TAGS else []
+    for child in element:
+        # comments have no string tag
+        if isinstance(child.tag, str):
+            texts.append(element_text(child))
+        texts.append(soup_string(child.tail))
+    return "".join(texts)
+
+
+def soup_string(text):
+    """
+    Strings consisting of whitespaces only are collapsed into
+    a single line break or space, as done by BeautifulSoup.
+    """
+    if not text:
+        return ""
+    if text.strip(ASCII_SPACES):
+        return text
+    return "\n" if "\n" in text else " "
+
+
+def _walk(element, page):
+    for child in element:
+        if not isinstance(child.tag, str):
+            continue
+        classes = child.get("class", "").split()
+        # prune navigation bar
+        if child.tag == "div" and "navbox" in classes:
+            continue
+
+        if child.tag == "a":
+            _add_anchor(child, page)
+        elif child.tag == "table" and page.infobox is None and "infobox" in classes:
+            page.infobox = child
+        elif child.tag == "div" and page.content is None and "mw-parser-output" in classes:
+            page.content = child
+        _walk(child, page)
+
+
+def _add_anchor(tag, page):
+    # anchor text
+    text = element_text(tag).strip()
+    if len(text) < 3:
+        return
+    href = tag.get("href")
+
+    # duplicate anchor text (keep first)
+    # -> later ones can be more specific/incorrect
+    if not page.event_anchor_dict.get(text) and href:
+        page.event_anchor_dict[text] = href.replace("/wiki/", "")
+
+    if not page.anchor_dict.get(text) and wiki.is_wikipedia_path(href):
+        page.anchor_dict[text] = wiki.format_wiki_path(href)
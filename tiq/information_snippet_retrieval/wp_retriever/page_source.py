@@ -0,0 +1,182 @@
+"""
+Sources for Wikipedia pages: html, plain text extracts and redirects.
+
+- online: live en.wikipedia.org (via the shared HTTP client)
+- offline: a local, indexed archive of pre-extracted pages (SQLite, random access by title)
+- record: live en.wikipedia.org, storing every response in the archive,
+  such that later runs can be reproduced with the offline source.
+"""
+import os
+
+from tiq.library.http_library import get_http_client
+from tiq.library.sqlite_store import SqliteStore
+from tiq.library.utils import get_logger
+from tiq.library.wikipedia_library import _wiki_title_to_path
+
+API_URL = "http://en.wikipedia.org/w/api.php"
+PARAMS = {
+    "prop": "extracts|revisions",
+    "format": "json",
+    "action": "query",
+    "explaintext": "",
+    "rvprop": "content",
+}
+
+
+class OnlinePageSource:
+    def __init__(self, config):
+        self.config = config
+        self.logger = get_logger(__name__, config)
+        self.http_client = get_http_client(config)
+
+    def get_html(self, wiki_title):
+        """
+        Retrieve Wikipedia html for the given Wikipedia Title.
+        """
+        wiki_path = _wiki_title_to_path(wiki_title)
+        link = f"https://en.wikipedia.org/wiki/{wiki_path}"
+        page = self.http_client.get(link, endpoint="wikipedia_html")
+        if page is None:
+            return None
+        return page.text
+
+    def get_extract(self, wiki_title):
+        """
+        Retrieve the content (plain text extract) of the given wikipedia title.
+        """
+        params = PARAMS.copy()
+        params["titles"] = wiki_title
+        # make request
+        res = self.http_client.get_json(API_URL, params=params, endpoint="wikipedia_extracts")
+        try:
+            pages = res["query"]["pages"]
+            page = list(pages.values())[0]
+        except (TypeError, KeyError, IndexError):
+            self.logger.debug(f"No extract found for {wiki_title}.")
+            return None
+        return page
+
+    def get_redirects(self, wiki_paths):
+        """
+        Extract redirects of given (max.) 50 Wikipedia paths (one entity can have multiple paths).
+        Returns a dictionary from the given Wikipedia path to the redirected Wikipedia title,
+        or None if the request failed.
+        """
+        # initialize
+        redirects = dict()
+
+        # create request url
+        wiki_paths_string = "|".join(wiki_paths)
+        url = f"https://en.wikipedia.org/w/api.php?action=query&format=json&titles={wiki_paths_string}&redirects"
+
+        # retrieve result
+        res_dict = self.http_client.get_json(url, endpoint="wikipedia_redirects")
+        if res_dict is None:
+            return None
+
+        ## result has mappings:
+        #   normalized: wiki_path -> wiki_title
+        #   redirects: wiki_title -> redirected wiki_title
+        if res_dict["query"].get("normalized"):
+            normalized = {
+                normalized["to"]: normalized["from"]
+                for normalized in res_dict["query"]["normalized"]
+            }
+        else:
+            normalized = dict()
+
+        # if redirects not set, no redirects required!
+        if not res_dict["query"].get("redirects"):
+            return redirects
+
+        # create redirects dict
+        for redirect in res_dict["query"]["redirects"]:
+            # get key
+            if normalized.get(redirect["from"]):
+                key = normalized[redirect["from"]]
+            else:
+                key = redirect["from"]
+
+            # add entry
+            redirects[key] = redirect["to"]
+        return redirects
+
+
+class OfflinePageSource:
+    """
+    Serves pages from a local archive with one table per content type,
+    keyed by the Wikipedia title (html, extracts) or the Wikipedia path (redirects).
+    Pages missing in the archive are treated as not existing.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.logger = get_logger(__name__, config)
+        self.path_to_archive = os.path.join(self.config["data_path"], self.config["wikipedia_archive_file"])
+        self.logger.info(f"Serving Wikipedia pages from archive at path {self.path_to_archive}.")
+        self.html = SqliteStore(self.path_to_archive, table="html")
+        self.extracts = SqliteStore(self.path_to_archive, table="extracts")
+        self.redirects = SqliteStore(self.path_to_archive, table="redirects")
+
+    def get_html(self, wiki_title):
+        html = self.html.get(wiki_title)
+        if html is None:
+            self.logger.debug(f"No html found in archive for {wiki_title}.")
+        return html
+
+    def get_extract(self, wiki_title):
+        page = self.extracts.get(wiki_title)
+        if page is None:
+            self.logger.debug(f"No extract found in archive for {wiki_title}.")
+        return page
+
+    def get_redirects(self, wiki_paths):
+        redirects = dict()
+        for wiki_path in wiki_paths:
+            redirect = self.redirects.get(wiki_path)
+            if redirect is not None:
+                redirects[wiki_path] = redirect
+        return redirects
+
+
+class RecordingPageSource(OfflinePageSource):
+    """
+    Retrieves pages from Wikipedia, and adds them to the archive.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.online_source = OnlinePageSource(config)
+
+    def get_html(self, wiki_title):
+        html = self.online_source.get_html(wiki_title)
+        if html is not None:
+            self.html[wiki_title] = html
+        return html
+
+    def get_extract(self, wiki_title):
+        page = self.online_source.get_extract(wiki_title)
+        if page is not None:
+            self.extracts[wiki_title] = page
+        return page
+
+    def get_redirects(self, wiki_paths):
+        redirects = self.online_source.get_redirects(wiki_paths)
+        if redirects:
+            self.redirects.put_many(redirects.items())
+        return redirects
+
+
+PAGE_SOURCES = {
+    "online": OnlinePageSource,
+    "offline": OfflinePageSource,
+    "record": RecordingPageSource,
+}
+
+
+def get_page_source(config):
+    """Create the Wikipedia page source set in the config."""
+    page_source = config["wikipedia_page_source"]
+    if page_source not in PAGE_SOURCES:
+        raise ValueError(f"Unknown Wikipedia page source: {page_source}. Options: {list(PAGE_SOURCES.keys())}")
+    return PAGE_SOURCES[page_source](config)
@@ -1,5 +1,27 @@
 import re
 
+# elements (and classes of elements) without running text
+SKIPPED_TAGS = {"table", "style", "script", "figure", "math", "img", "noscript"}
+SKIPPED_CLASSES = {
+    "reference",
+    "mw-editsection",
+    "navbox",
+    "hatnote",
+    "thumb",
+    "toc",
+    "reflist",
+    "mw-references-wrap",
+    "references",
+    "shortdescription",
+    "metadata",
+    "ambox",
+    "sistersitebox",
+    "noprint",
+    "mw-empty-elt",
+}
+HEADING_TAGS = {"h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+BLOCK_TAGS = {"p", "li", "dd", "dt"}
+
 
 def extract_text_snippets(wiki_md, wiki_title, nlp):
     """
@@ -56,3 +78,56 @@ def _filter_noise(wiki_content):
     while "  " in content:
         content = content.replace("  ", " ")
     return content
+
+
+def extract_text_from_html(content):
+    """
+    Derive the plain text of the page from the html content element
+    (div.mw-parser-output, see page_parser), in the format of the
+    plain text extracts (headings as "== Heading ==").
+    Tables (incl. infobox), references and navigation elements are dropped.
+    The result can be used as markdown in extract_text_snippets.
+    """
+    if content is None:
+        return None
+    blocks = list()
+    _collect_blocks(content, blocks)
+    return {"extract": "\n".join(blocks)}
+
+
+def _collect_blocks(element, blocks):
+    for child in element:
+        if not isinstance(child.tag, str) or _is_skipped(child):
+            continue
+        if child.tag in HEADING_TAGS:
+            marker = "=" * HEADING_TAGS[child.tag]
+            heading = _node_text(child).strip()
+            blocks.append(f"\n{marker} {heading} {marker}")
+        elif child.tag in BLOCK_TAGS:
+            text = _node_text(child).strip()
+            if text:
+                blocks.append(text)
+            # nested lists
+            for nested_list in child:
+                if nested_list.tag in ("ul", "ol", "dl"):
+                    _collect_blocks(nested_list, blocks)
+        else:
+            _collect_blocks(child, blocks)
+
+
+def _node_text(element):
+    texts = [element.text or ""]
+    for child in element:
+        # comments have no string tag
+        if isinstance(child.tag, str) and child.tag not in ("ul", "ol", "dl") and not _is_skipped(child):
+            texts.append(_node_text(child))
+        # nested lists are separate blocks
+        texts.append(child.tail or "")
+    return "".join(texts)
+
+
+def _is_skipped(element):
+    if element.tag in SKIPPED_TAGS:
+        return True
+    classes = element.get("class", "").split()
+    return any(cls in SKIPPED_CLASSES for cls in classes)
@@ -2,10 +2,8 @@ import os
 import pickle
 import re
 import time
-from pathlib import Path
 from urllib.parse import quote
 
-import requests
 import spacy
 from bs4 import BeautifulSoup
 from filelock import FileLock
@@ -16,24 +14,22 @@ from tiq.information_snippet_retrieval.wp_retriever.infobox_parser import (
     infobox_to_evidences,
 )
 from tiq.information_snippet_retrieval.wp_retriever.text_parser import (
+    extract_text_from_html,
     extract_text_snippets,
 )
+from tiq.information_snippet_retrieval.wp_retriever.page_parser import parse_page
+from tiq.information_snippet_retrieval.wp_retriever.page_source import get_page_source
+from tiq.library.entity_metadata import EntityMetadataService
+from tiq.library.http_library import fetch_concurrently
+from tiq.library.sqlite_store import SqliteStore
 from tiq.library.temporal_expression import TemporalExpression
+from tiq.library.tracing import get_tracer
 from tiq.library.utils import get_logger
-from tiq.library.wikipedia_library import _wiki_path_to_title, format_wiki_path, \
-    is_wikipedia_path, _wiki_title_to_path
+from tiq.library.wikipedia_library import _wiki_path_to_title
 
 ENT_PATTERN = re.compile("^Q[0-9]+$")
 MY_PATTERN = re.compile(
     "\b(?:January|February|March|April|May|June|July|August|September|October|November|December)\s\d{4}\b")
-API_URL = "http://en.wikipedia.org/w/api.php"
-PARAMS = {
-    "prop": "extracts|revisions",
-    "format": "json",
-    "action": "query",
-    "explaintext": "",
-    "rvprop": "content",
-}
 
 
 class WikipediaEntityPageRetriever:
@@ -44,7 +40,8 @@ class WikipediaEntityPageRetriever:
     def __init__(self, config, clocq, wikidata_mappings, wikipedia_mappings):
         self.config = config
         self.logger = get_logger(__name__, config)
-        self.use_cache = False
+        self.tracer = get_tracer(config)
+        self.use_cache = self.config["wikipedia_use_cache"]
         self.data_path = self.config["data_path"]
         self.wikipedia_dump_file = self.config["wikipedia_dump_file"]
         self.path_to_dump = os.path.join(self.data_path, self.wikipedia_dump_file)
@@ -57,14 +54,24 @@ class WikipediaEntityPageRetriever:
         self.nlp = spacy.blank("en")
         self.nlp.add_pipe("sentencizer")
         self.logger.debug("WikipediaRetriever successfully initialized!")
-        self.entity_type_map = {}
+        # types and frequencies of entities, shared by all components using this retriever
+        self.entity_metadata = EntityMetadataService(config, clocq)
+
+        # pages downloaded ahead of their annotation (see prefetch_pages)
+        self.fetch_workers = self.config["page_fetch_workers"]
+        self.prefetched_pages = dict()
+        # derive the plain text from the html instead of retrieving the plain text extract
+        self.text_from_html = self.config["wikipedia_text_from_html"]
+        # html, plain text extracts and redirects (live Wikipedia or local archive)
+        self.page_source = get_page_source(config)
+
         if self.use_cache:
             self._init_wikipediaentity_dump()
-            self.dump_changed = False
 
         self.temporal_expression = TemporalExpression(config)
         # initialize evidence annotator (used for (text)->Wikipedia->Wikidata)
-        self.annotator = EvidenceAnnotator(config, self.temporal_expression, self.wikidata_mappings)
+        self.annotator = EvidenceAnnotator(config, self.temporal_expression, self.wikidata_mappings,
+                                           self.page_source)
 
     def _filter_noise_entity_evidence(self, evidence):
         non_date_entities = []
@@ -99,11 +106,7 @@ class WikipediaEntityPageRetriever:
         for item in evidence["wikidata_entities"]:
             if ENT_PATTERN.match(item["id"]):
                 # QID
-                if item["id"] in self.entity_type_map:
-                    entity_type = self.entity_type_map[item["id"]]
-                else:
-                    entity_type = self.clocq.get_type(item["id"])
-                    self.entity_type_map[item["id"]] = entity_type
+                entity_type = self.entity_metadata.get_type(item["id"])
                 if entity_type:
                     item["type"] = entity_type["label"]
                     type = entity_type["label"].lower()
@@ -150,11 +153,7 @@ class WikipediaEntityPageRetriever:
         for item in evidence["wikidata_entities"]:
             if ENT_PATTERN.match(item["id"]):
                 # QID
-                if item["id"] in self.entity_type_map:
-                    entity_type = self.entity_type_map[item["id"]]
-                else:
-                    entity_type = self.clocq.get_type(item["id"])
-                    self.entity_type_map[item["id"]] = entity_type
+                entity_type = self.entity_metadata.get_type(item["id"])
                 if entity_type:
                     # add type label to entity
                     item["type"] = entity_type["label"]
@@ -175,6 +174,7 @@ class WikipediaEntityPageRetriever:
     def year_evidences_selection(self, evidences):
         # prune evidences with more than one timespan etc
         selected_evidences = []
+        self._prefetch_entity_types(evidences)
         for evidence in evidences:
             # check the number of dates in each evidence text meanwhile adding the type for each entity
             non_date_entities = self._filter_noise_year_evidence(evidence)
@@ -199,41 +199,13 @@ class WikipediaEntityPageRetriever:
             return None
 
     def _retrieve_event_markdown(self, wiki_title):
-        base_url = "https://en.wikipedia.org/wiki/"
-        link = f"{base_url}{wiki_title}"
-        try:
-            response = requests.get(link)
-            soup = BeautifulSoup(response.content, features="html.parser")
-            content_div = soup.find("div", {"id": "mw-content-text"})
-            if content_div:
-                return content_div.contentsget_text()
-        except:
+        html = self._retrieve_html(wiki_title)
+        if html is None:
             return None
-
-    def _build_event_document_anchor_dict(self, soup):
-        # prune navigation bar
-        for div in soup.find_all("div", {"class": "navbox"}):
-            div.decompose()
-
-        # go through links
-        anchor_dict = dict()
-        for tag in soup.find_all("a"):
-            # anchor text
-            text = tag.text.strip()
-            if len(text) < 3:
-                continue
-            # duplicate anchor text (keep first)
-            # -> later ones can be more specific/incorrect
-            if anchor_dict.get(text):
-                continue
-
-            # wiki title (=entity)
-            href = tag.attrs.get("href")
-            if href:
-                wiki_path = href.replace("/wiki/", "")
-
-                anchor_dict[text] = wiki_path
-        return anchor_dict
+        soup = BeautifulSoup(html, features="html.parser")
+        content_div = soup.find("div", {"id": "mw-content-text"})
+        if content_div:
+            return content_div.get_text()
 
     def wp_event_retriever(self, year_id_path_lable):
         """
@@ -245,29 +217,28 @@ class WikipediaEntityPageRetriever:
         wikidata_id = year_id_path_lable["id"]
         wiki_path = year_id_path_lable["wiki_path"]
 
-        if self.use_cache and wikidata_id in self.wikipedia_dump:
+        wikidata_entities = self.wikipedia_dump.get(wikidata_id) if self.use_cache else None
+        if wikidata_entities is not None:
             self.logger.debug(f"Found Wikipedia evidences in dump!")
-            wikidata_entities = self.wikipedia_dump.get(wikidata_id)
 
         else:
 
             # get Wikipedia title
             wiki_title = _wiki_path_to_title(wiki_path)
-            # retrieve Wikipedia soup
-            soup = self._retrieve_soup(wiki_title)
+            # retrieve and parse Wikipedia html
+            page = self._retrieve_page(wiki_title)
 
-            if soup is None:
+            if page is None:
                 if self.use_cache:
                     self.wikipedia_dump[wikidata_id] = []  # remember
                 return []
 
             # extract anchors
-            doc_anchor_dict = self._build_event_document_anchor_dict(soup)
+            doc_anchor_dict = page.event_anchor_dict
             wikidata_entities = self.annotator.annotate_wikidata_events(wiki_title, doc_anchor_dict)
 
-            if self.use_cache and wikidata_id not in self.wikipedia_dump:
+            if self.use_cache:
                 self.wikipedia_dump[wikidata_id] = wikidata_entities
-                self.dump_changed = True
 
         self.logger.debug(f"Entities on the event page successfully retrieved for {year_id_path_lable}.")
         self.logger.debug(f"Number of Entities on the event page: {len(wikidata_entities)}.")
@@ -286,28 +257,28 @@ class WikipediaEntityPageRetriever:
 
         entities = []
 
-        if self.use_cache and wikidata_id in self.wikipedia_dump:
+        text_snippets = self.wikipedia_dump.get(wikidata_id) if self.use_cache else None
+        if text_snippets is not None:
             self.logger.debug(f"Found Wikipedia evidences in dump!")
-            text_snippets = self.wikipedia_dump.get(wikidata_id)
 
         else:
             # get Wikipedia title
             wiki_title = _wiki_path_to_title(wiki_path)
-            # retrieve Wikipedia soup
+            # retrieve and parse Wikipedia html
             print("wiki_title")
             print(wiki_title)
-            soup = self._retrieve_soup(wiki_title)
+            page = self._retrieve_page(wiki_title)
 
-            if soup is None:
+            if page is None:
                 if self.use_cache:
                     self.wikipedia_dump[wikidata_id] = []  # remember
                 return [], entities
 
             # retrieve Wikipedia markdown
-            wiki_md = self._retrieve_markdown(wiki_title)
+            wiki_md = self._retrieve_page_text(wiki_title, page)
 
             # extract anchors
-            doc_anchor_dict = self._build_document_anchor_dict(soup)
+            doc_anchor_dict = page.anchor_dict
 
             # retrieve evidences
             text_snippets = self._retrieve_text_snippets(wiki_title, wiki_md)
@@ -318,9 +289,8 @@ class WikipediaEntityPageRetriever:
 
             self.annotator.annotate_wikidata_entities(wiki_title, text_snippets, doc_anchor_dict)
 
-            if self.use_cache and wikidata_id not in self.wikipedia_dump:
+            if self.use_cache:
                 self.wikipedia_dump[wikidata_id] = text_snippets
-                self.dump_changed = True
 
         for item in text_snippets:
             if "wikidata_entities" not in item:
@@ -343,9 +313,9 @@ class WikipediaEntityPageRetriever:
         # retrieve Wikipedia soup
         entity_id = entity["id"]
 
-        if self.use_cache and entity_id in self.wikipedia_dump:
+        evidences = self.wikipedia_dump.get(entity_id) if self.use_cache else None
+        if evidences is not None:
             self.logger.debug(f"Found Wikipedia evidences in dump!")
-            evidences = self.wikipedia_dump.get(entity_id)
 
         else:
             # get Wikipedia title
@@ -359,25 +329,24 @@ class WikipediaEntityPageRetriever:
                     self.wikipedia_dump[entity_id] = []  # remember
                 return []
             self.logger.debug(f"Retrieving Wikipedia evidences for: {wiki_path}.")
-            self.dump_changed = True
 
-            # retrieve Wikipedia soup
+            # retrieve and parse Wikipedia html
             wiki_title = _wiki_path_to_title(wiki_path)
 
-            soup = self._retrieve_soup(wiki_title)
-            if soup is None:
+            page = self._retrieve_page(wiki_title)
+            if page is None:
                 if self.use_cache:
                     self.wikipedia_dump[entity_id] = []  # remember
                 return []
 
             # retrieve Wikipedia markdown
-            wiki_md = self._retrieve_markdown(wiki_title)
+            wiki_md = self._retrieve_page_text(wiki_title, page)
 
             # extract anchors
-            doc_anchor_dict = self._build_document_anchor_dict(soup)
+            doc_anchor_dict = page.anchor_dict
 
             # retrieve evidences
-            infobox_evidences = self._retrieve_infobox_entries(wiki_title, soup, doc_anchor_dict)
+            infobox_evidences = self._retrieve_infobox_entries(wiki_title, page, doc_anchor_dict)
             text_snippets = self._retrieve_text_snippets(wiki_title, wiki_md)
 
             for evidence in text_snippets:
@@ -392,9 +361,8 @@ class WikipediaEntityPageRetriever:
 
             self.annotator.annotate_wikidata_entities(wiki_path, evidences, doc_anchor_dict)
 
-            if self.use_cache and entity_id not in self.wikipedia_dump:
+            if self.use_cache:
                 self.wikipedia_dump[entity_id] = evidences
-                self.dump_changed = True
 
         self.logger.debug(f"Evidences successfully retrieved for {entity}.")
         evidences = self.entity_evidences_selection(evidences)
@@ -409,6 +377,7 @@ class WikipediaEntityPageRetriever:
         short, long, or contain too many symbols.
         """
         selected_evidences = list()
+        self._prefetch_entity_types(evidences)
         for evidence in evidences:
             # only keep evidences having timespans
             non_date_entities = self._filter_noise_entity_evidence(evidence)
@@ -419,21 +388,24 @@ class WikipediaEntityPageRetriever:
                     selected_evidences.append(evidence)
         return selected_evidences
 
-    def _retrieve_infobox_entries(self, wiki_title, soup, doc_anchor_dict):
+    def _prefetch_entity_types(self, evidences):
+        """Look up the types of all entities in the evidences in one bulk request."""
+        qids = [item["id"] for evidence in evidences for item in evidence.get("wikidata_entities", [])
+                if ENT_PATTERN.match(item["id"])]
+        self.entity_metadata.get_type_bulk(qids)
+
+    def _retrieve_infobox_entries(self, wiki_title, page, doc_anchor_dict):
         """
         Retrieve infobox entries for the given Wikipedia entity.
         """
         # get infobox (only one infobox possible)
-
-        infoboxes = soup.find_all("table", {"class": "infobox"})
-        if not infoboxes:
+        infobox = page.infobox
+        if infobox is None:
             return []
-        infobox = infoboxes[0]
 
         # parse infobox content
         p = InfoboxParser(doc_anchor_dict)
-        infobox_html = str(infobox)
-        p.feed(infobox_html)
+        p.feed_element(infobox)
 
         # transform parsed infobox to evidences
         infobox_parsed = p.tables[0]
@@ -449,38 +421,6 @@ class WikipediaEntityPageRetriever:
         evidences = extract_text_snippets(wiki_md, wiki_title, self.nlp)
         return evidences
 
-    def _build_document_anchor_dict(self, soup):
-        """
-        Establishes a dictionary that maps from Wikipedia text
-        to the Wikipedia entity (=link). Is used to map to
-        Wikidata entities (via Wikipedia) later.
-        Format: text -> Wikidata entity.
-        """
-        # prune navigation bar
-        for div in soup.find_all("div", {"class": "navbox"}):
-            div.decompose()
-
-        # go through links
-        anchor_dict = dict()
-        for tag in soup.find_all("a"):
-            # anchor text
-            text = tag.text.strip()
-            if len(text) < 3:
-                continue
-            # duplicate anchor text (keep first)
-            # -> later ones can be more specific/incorrect
-            if anchor_dict.get(text):
-                continue
-
-            # wiki title (=entity)
-            href = tag.attrs.get("href")
-            if not is_wikipedia_path(href):
-                continue
-            wiki_path = format_wiki_path(href)
-
-            anchor_dict[text] = wiki_path
-        return anchor_dict
-
     def safequote(self, string):
         """
         Try to UTF-8 encode and percent-quote string
@@ -504,118 +444,124 @@ class WikipediaEntityPageRetriever:
 
         return qry
 
-    def _retrieve_soup(self, wiki_title):
+    def prefetch_pages(self, pages):
+        """
+        Download the html (and the plain text for year pages) of the given
+        year/month pages concurrently. The downloaded content is kept in memory
+        and consumed by _retrieve_page and _retrieve_markdown, such that the
+        annotation of the pages does not wait for the network.
+        The html is parsed right away.
+        The redirects of the links on all pages are resolved together,
+        in requests of (up to) 50 Wikipedia paths.
+        """
+        fetch_requests = list()
+        for page in pages:
+            if self.use_cache and page["id"] in self.wikipedia_dump:
+                continue
+            wiki_title = _wiki_path_to_title(page["wiki_path"])
+            fetch_requests.append(("html", wiki_title))
+            if page["page_type"] == "year" and not self.text_from_html:
+                fetch_requests.append(("markdown", wiki_title))
+
+        start = time.time()
+        results = fetch_concurrently(self._fetch, fetch_requests, self.fetch_workers)
+        wiki_paths = list()
+        for fetch_request, result in zip(fetch_requests, results):
+            content_type, wiki_title = fetch_request
+            if content_type == "html":
+                page = parse_page(result)
+                if page is not None:
+                    wiki_paths.extend(page.anchor_dict.values())
+                self.prefetched_pages[("page", wiki_title)] = page
+            else:
+                self.prefetched_pages[fetch_request] = result
+        self.annotator.extract_redirects(wiki_paths)
+        self.logger.info(f"Prefetched {len(fetch_requests)} pages in {time.time() - start} seconds.")
+
+    def clear_prefetched_pages(self):
+        """Drop prefetched pages which were not consumed."""
+        self.prefetched_pages = dict()
+
+    def _fetch(self, fetch_request):
+        content_type, wiki_title = fetch_request
+        if content_type == "html":
+            return self._retrieve_html(wiki_title)
+        return self._retrieve_markdown(wiki_title)
+
+    def _retrieve_html(self, wiki_title):
         """
         Retrieve Wikipedia html for the given Wikipedia Title.
         """
-        wiki_path = _wiki_title_to_path(wiki_title)
-        link = f"https://en.wikipedia.org/wiki/{wiki_path}"
-        try:
-            page = requests.get(link)
-            # Create your etree with a StringIO object which functions similarly
-            # to a fileHandler
-            # Decode the page content from bytes to string
-            # page_utf8 = page.content.decode("utf-8")
-            # ptree = etree.parse(StringIO(page_utf8), parser=parser)
-            soup = BeautifulSoup(page.text, features="html.parser")
-        except:
-            return None
-        return soup
+        html = self.page_source.get_html(wiki_title)
+        if html is not None:
+            self.tracer.count("pages_fetched")
+        return html
+
+    def _retrieve_page(self, wiki_title):
+        """
+        Retrieve Wikipedia html for the given Wikipedia Title,
+        and parse it (see page_parser).
+        """
+        if ("page", wiki_title) in self.prefetched_pages:
+            return self.prefetched_pages.pop(("page", wiki_title))
+        html = self._retrieve_html(wiki_title)
+        return parse_page(html)
 
     def _retrieve_markdown(self, wiki_title):
         """
         Retrieve the content of the given wikipedia title.
         """
-        params = PARAMS.copy()
-        params["titles"] = wiki_title
-        try:
-            # make request
-            r = requests.get(API_URL, params=params)
-            res = r.json()
-            pages = res["query"]["pages"]
-            page = list(pages.values())[0]
-        except:
-            return None
-        return page
+        if ("markdown", wiki_title) in self.prefetched_pages:
+            return self.prefetched_pages.pop(("markdown", wiki_title))
+        return self.page_source.get_extract(wiki_title)
+
+    def _retrieve_page_text(self, wiki_title, page):
+        """
+        Retrieve the plain text of the given wikipedia title,
+        either from the given parsed page or as plain text extract.
+        """
+        if self.text_from_html:
+            return extract_text_from_html(page.content)
+        return self._retrieve_markdown(wiki_title)
 
     def _init_wikipediaentity_dump(self):
         """
         Initialize the Wikipedia dump. The consists of a mapping
         from Wikidata IDs to Wikipedia evidences in the expected format.
+        The dump is stored in SQLite: entries are read lazily per QID,
+        and written as soon as they are retrieved, such that multiple
+        processes can share the dump without loading it into memory.
         """
-        if os.path.isfile(self.path_to_dump):
-            # remember version read initially
-            self.logger.info(f"Loading Wikipedia dump from path {self.path_to_dump}.")
-            with FileLock(f"{self.path_to_dump}.lock"):
-                self.dump_version = self._read_dump_version()
-                self.logger.info(f"Dump version {self.dump_version}.")
-                self.wikipedia_dump = self._read_dump()
-            self.logger.info(f"Wikipedia dump successfully loaded.")
-        else:
-            self.logger.info(
-                f"Could not find an existing Wikipedia dump at path {self.path_to_dump}."
-            )
-            self.logger.info("Populating Wikipedia dump from scratch!")
-            self.wikipedia_dump = {}
-            self._write_dump(self.wikipedia_dump)
-            self._write_dump_version()
+        self.logger.info(f"Opening Wikipedia dump at path {self.path_to_dump}.")
+        self.wikipedia_dump = SqliteStore(self.path_to_dump)
+        self._migrate_pickle_dump()
+        self.logger.info(f"Wikipedia dump successfully opened.")
 
-    def store_dump(self):
-        """Store the Wikipedia dumo to disk."""
-        if not self.use_cache:  # store only if Wikipedia dump in use
-            return
-        if not self.dump_changed:  # store only if Wikipedia dump  changed
+    def _migrate_pickle_dump(self):
+        """
+        Import the entries of a Wikipedia dump of earlier versions (pickled dictionary) once.
+        Entries already in the SQLite dump are kept. The pickle file is renamed afterwards.
+        """
+        path_to_pickle_dump = os.path.join(self.data_path, self.config["wikipedia_pickle_dump_file"])
+        if not os.path.isfile(path_to_pickle_dump):
             return
-        # check if the Wikipedia dump  was updated by other processes
-        if self._read_dump_version() == self.dump_version:
-            # no updates: store and update version
-            self.logger.info(f"Writing Wikipedia dump at path {self.path_to_dump}.")
-            with FileLock(f"{self.path_to_dump}.lock"):
-                self._write_dump(self.wikipedia_dump)
-                self._write_dump_version()
-        else:
-            # update! read updated version and merge the dumps
-            self.logger.info(f"Merging Wikipedia dump at path {self.path_to_dump}.")
-            with FileLock(f"{self.path_to_dump}.lock"):
-                # read updated version
-                updated_dump = self._read_dump()
-                # overwrite with changes in current process (most recent)
-                updated_dump.update(self.wikipedia_dump)
-                # store
-                self._write_dump(updated_dump)
-                self._write_dump_version()
-
-    def _read_dump(self):
+        with FileLock(f"{self.path_to_dump}.lock"):
+            # another process might have migrated the dump in the meantime
+            if not os.path.isfile(path_to_pickle_dump):
+                return
+            self.logger.info(f"Importing Wikipedia dump from path {path_to_pickle_dump}.")
+            with open(path_to_pickle_dump, "rb") as fp:
+                pickle_dump = pickle.load(fp)
+            self.wikipedia_dump.put_many((wikidata_id, evidences) for wikidata_id, evidences in pickle_dump.items()
+                                         if wikidata_id not in self.wikipedia_dump)
+            os.replace(path_to_pickle_dump, f"{path_to_pickle_dump}.migrated")
+            self.logger.info(f"Imported {len(pickle_dump)} entries, the pickle file was renamed.")
+
+    def store_dump(self):
         """
-        Read the current version of the dump.
-        This can be different from the version used in this file,
-        given that multiple processes may access it simultaneously.
+        Store the Wikipedia dump to disk.
+        Entries are written incrementally, so there is nothing left to store.
         """
-        # read file content from wikipedia dump shared across QU methods
-        self.logger.info(f"Start read dump {self.path_to_dump}.")
-        with open(self.path_to_dump, "rb") as fp:
-            wikipedia_dump = pickle.load(fp)
-        return wikipedia_dump
-
-    def _write_dump(self, dump):
-        """Store the dump."""
-        dump_dir = os.path.dirname(self.path_to_dump)
-        Path(dump_dir).mkdir(parents=True, exist_ok=True)
-        with open(self.path_to_dump, "wb") as fp:
-            pickle.dump(dump, fp)
-        return dump
-
-    def _read_dump_version(self):
-        """Read the dump version (hashed timestamp of last update) from a dedicated file."""
-        if not os.path.isfile(f"{self.path_to_dump}.version"):
-            self._write_dump_version()
-        with open(f"{self.path_to_dump}.version", "r") as fp:
-            dump_version = fp.readline().strip()
-        return dump_version
-
-    def _write_dump_version(self):
-        """Write the current dump version (hashed timestamp of current update)."""
-        with open(f"{self.path_to_dump}.version", "w") as fp:
-            version = str(time.time())
-            fp.write(version)
-        self.dump_version = version
+        if not self.use_cache:  # store only if Wikipedia dump in use
+            return
+        self.logger.info(f"Wikipedia dump at path {self.path_to_dump} is up to date.")
@@ -0,0 +1,204 @@
+"""
+Append-only (log-structured) key-value store, used for caches which are
+shared between pipeline processes.
+
+The store is a single file of records:
+    [key length (4 bytes)][value length (4 bytes)][key (utf-8)][value (pickled)]
+Later records overwrite earlier records with the same key.
+Each process keeps an index from keys to record offsets in memory,
+and values are only read (and unpickled) on access.
+New entries are buffered and appended to the file on flush.
+"""
+import os
+import pickle
+import struct
+import threading
+
+from filelock import FileLock
+
+HEADER = struct.Struct(">II")
+# read the file in blocks of this size when building the index
+SCAN_BLOCK_SIZE = 1 << 20
+
+
+class AppendOnlyStore:
+    def __init__(self, path, flush_size=1000, compaction_ratio=0.3):
+        """
+        :param path: path of the store file
+        :param flush_size: number of buffered entries after which they are appended to the file
+        :param compaction_ratio: rewrite the file when the share of overwritten bytes exceeds this ratio
+        """
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.flush_size = flush_size
+        self.compaction_ratio = compaction_ratio
+
+        dump_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dump_dir, exist_ok=True)
+
+        self.lock = threading.RLock()
+        self.pending = dict()
+        self.index = dict()  # key -> (offset of value, length of value)
+        self.end = 0  # offset up to which the file was indexed
+        self.garbage = 0  # number of bytes in overwritten records
+        self.fd = None
+        self.inode = None
+        with FileLock(self.lock_path):
+            if not os.path.isfile(self.path):
+                open(self.path, "wb").close()
+            self._open()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            location = self.index.get(key)
+            if location is None:
+                # the entry might have been appended by another process
+                self._refresh()
+                location = self.index.get(key)
+                if location is None:
+                    return default
+            offset, length = location
+            value = os.pread(self.fd, length, offset)
+        return pickle.loads(value)
+
+    def put(self, key, value):
+        with self.lock:
+            self.pending[key] = value
+            if len(self.pending) >= self.flush_size:
+                self.flush()
+
+    def flush(self):
+        """Append all buffered entries to the file, and compact it if required."""
+        with self.lock:
+            if not self.pending:
+                return
+            records = bytearray()
+            locations = list()
+            for key, value in self.pending.items():
+                key_bytes = key.encode("utf-8")
+                value_bytes = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                value_offset = len(records) + HEADER.size + len(key_bytes)
+                locations.append((key, value_offset, len(value_bytes)))
+                records += HEADER.pack(len(key_bytes), len(value_bytes))
+                records += key_bytes
+                records += value_bytes
+
+            with FileLock(self.lock_path):
+                # index entries appended by other processes first,
+                # and drop an incomplete record left by a crashed writer
+                self._refresh()
+                if os.fstat(self.fd).st_size > self.end:
+                    os.truncate(self.path, self.end)
+                with open(self.path, "ab") as fp:
+                    fp.write(records)
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                for key, value_offset, length in locations:
+                    self._add_to_index(key, self.end + value_offset, length)
+                self.end += len(records)
+                self.pending = dict()
+
+                if self.end and self.garbage / self.end > self.compaction_ratio:
+                    self._compact()
+
+    def keys(self):
+        with self.lock:
+            self._refresh()
+            return list(self.index.keys() | self.pending.keys())
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.pending or key in self.index:
+                return True
+            self._refresh()
+            return key in self.index
+
+    def __getitem__(self, key):
+        with self.lock:
+            if key not in self:
+                raise KeyError(key)
+            return self.get(key)
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __len__(self):
+        return len(self.keys())
+
+    def _open(self):
+        """(Re-)open the file and build the index from scratch."""
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = os.open(self.path, os.O_RDONLY)
+        self.inode = os.fstat(self.fd).st_ino
+        self.index = dict()
+        self.end = 0
+        self.garbage = 0
+        self._scan()
+
+    def _refresh(self):
+        """Index records appended (or a compaction done) by other processes."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return
+        if inode != self.inode:
+            # the file was compacted: offsets in the index are outdated
+            self._open()
+        elif os.fstat(self.fd).st_size > self.end:
+            self._scan()
+
+    def _scan(self):
+        """Index all complete records after the current end of the index."""
+        size = os.fstat(self.fd).st_size
+        offset = self.end
+        buffer = b""
+        buffer_start = offset
+        while offset + HEADER.size <= size:
+            position = offset - buffer_start
+            if position + HEADER.size > len(buffer):
+                buffer = os.pread(self.fd, min(SCAN_BLOCK_SIZE, size - offset), offset)
+                buffer_start = offset
+                position = 0
+            key_length, value_length = HEADER.unpack_from(buffer, position)
+            record_end = offset + HEADER.size + key_length + value_length
+            if record_end > size:
+                # incomplete record (still being written, or crashed writer)
+                break
+            if position + HEADER.size + key_length > len(buffer):
+                buffer = os.pread(self.fd, max(SCAN_BLOCK_SIZE, HEADER.size + key_length), offset)
+                buffer_start = offset
+                position = 0
+            key_start = position + HEADER.size
+            key = buffer[key_start:key_start + key_length].decode("utf-8")
+            # values are skipped, and only read on access
+            self._add_to_index(key, offset + HEADER.size + key_length, value_length)
+            offset = record_end
+            self.end = offset
+
+    def _add_to_index(self, key, value_offset, length):
+        if key in self.index:
+            _, old_length = self.index[key]
+            self.garbage += HEADER.size + len(key.encode("utf-8")) + old_length
+        self.index[key] = (value_offset, length)
+
+    def _compact(self):
+        """
+        Rewrite the file with the latest record per key only.
+        Must be called while holding the file lock.
+        """
+        compacted_path = f"{self.path}.compact"
+        with open(compacted_path, "wb") as fp:
+            for key, (offset, length) in self.index.items():
+                key_bytes = key.encode("utf-8")
+                fp.write(HEADER.pack(len(key_bytes), length))
+                fp.write(key_bytes)
+                fp.write(os.pread(self.fd, length, offset))
+            fp.flush()
+            os.fsync(fp.fileno())
+        # processes still reading the old file keep a valid file descriptor,
+        # and re-build their index on their next refresh (inode changed)
+        os.replace(compacted_path, self.path)
+        self._open()
@@ -0,0 +1,130 @@
+"""
+Persistent cache for sentence embeddings.
+
+Embeddings are stored as rows of a flat float16/float32 file which is
+memory-mapped for reading. The hashes of (model, text) are stored in a
+keys file in the same order (fixed-size records): row i of the vectors
+file is the embedding of key i. New embeddings and their keys are appended
+under a file lock, so the cache can be shared by multiple pipeline processes,
+and other processes only read the keys appended since their last read.
+"""
+import hashlib
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+from filelock import FileLock
+
+from tiq.library.tracing import get_tracer
+from tiq.library.utils import get_logger
+
+# size of a key (sha1 digest) in the keys file
+KEY_SIZE = 20
+
+
+class EmbeddingCache:
+    def __init__(self, config, model, model_name):
+        self.config = config
+        self.logger = get_logger(__name__, config)
+        self.tracer = get_tracer(config)
+        self.model = model
+        self.model_name = model_name
+        self.dtype = np.dtype(self.config["embedding_cache_dtype"])
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+        cache_dir = Path(os.path.join(self.config["data_path"], self.config["embedding_cache_dir"]))
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        file_name = f"{re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)}.{self.dtype.name}"
+        self.vectors_path = os.path.join(cache_dir, f"{file_name}.vectors")
+        self.keys_path = os.path.join(cache_dir, f"{file_name}.keys")
+        self.lock_path = f"{self.vectors_path}.lock"
+
+        # key -> row, and number of rows read from the keys file
+        self.index = dict()
+        self.rows = 0
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+        self._refresh_index()
+
+    def encode(self, texts, batch_size=32):
+        """
+        Return the embeddings of the given texts as float32 array (one row per text).
+        Only texts not yet in the cache are encoded by the model.
+        """
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        keys = [self._key(text) for text in texts]
+        self._refresh_index()
+
+        missing = dict()
+        for key, text in zip(keys, texts):
+            if key not in self.index and key not in missing:
+                missing[key] = text
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        if missing:
+            with self.tracer.span("embedding", texts=len(missing)):
+                embeddings = self.model.encode(list(missing.values()), batch_size=batch_size, convert_to_numpy=True)
+                self._append(list(missing.keys()), embeddings)
+            self.tracer.count("embeddings_computed", len(missing))
+
+        rows = [self.index[key] for key in keys]
+        return np.asarray(self._get_vectors()[rows], dtype=np.float32)
+
+    def statistics(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": hit_rate, "size": len(self.index)}
+
+    def _key(self, text):
+        return hashlib.sha1(f"{self.model_name}\n{text}".encode("utf-8")).digest()
+
+    def _append(self, keys, embeddings):
+        """Append the embeddings to the vectors file and their keys to the keys file."""
+        with FileLock(self.lock_path):
+            # other processes might have added entries in the meantime
+            self._refresh_index()
+            rows = [i for i, key in enumerate(keys) if key not in self.index]
+            if rows:
+                row_size = self.dimension * self.dtype.itemsize
+                # the keys file is the reference for the next row (robust to interrupted writes):
+                # vectors are written first, a row is valid once its key is written
+                start = self.rows
+                with open(self.vectors_path, "ab") as fp:
+                    fp.truncate(start * row_size)
+                    np.ascontiguousarray(embeddings[rows], dtype=self.dtype).tofile(fp)
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                with open(self.keys_path, "ab") as fp:
+                    fp.truncate(start * KEY_SIZE)
+                    fp.write(b"".join(keys[i] for i in rows))
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                for offset, i in enumerate(rows):
+                    self.index[keys[i]] = start + offset
+                self.rows = start + len(rows)
+        self.vectors = None
+
+    def _get_vectors(self):
+        """Memory-map the vectors file (re-mapped when new rows were added)."""
+        if self.vectors is None or len(self.vectors) < self.rows:
+            self.vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(self.rows, self.dimension))
+        return self.vectors
+
+    def _refresh_index(self):
+        """Read the keys appended (by this or another process) since the last read."""
+        if not os.path.isfile(self.keys_path):
+            return
+        # an incomplete record (interrupted write) is ignored
+        rows = os.path.getsize(self.keys_path) // KEY_SIZE
+        if rows <= self.rows:
+            return
+        with open(self.keys_path, "rb") as fp:
+            fp.seek(self.rows * KEY_SIZE)
+            data = fp.read((rows - self.rows) * KEY_SIZE)
+        for row in range(self.rows, rows):
+            offset = (row - self.rows) * KEY_SIZE
+            self.index[data[offset:offset + KEY_SIZE]] = row
+        self.rows = rows
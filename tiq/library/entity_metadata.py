@@ -0,0 +1,184 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from filelock import FileLock
+
+from tiq.library.http_library import fetch_concurrently
+from tiq.library.tracing import get_tracer
+from tiq.library.utils import get_logger
+
+
+class EntityMetadataService:
+    """
+    Shared access to the type(s) and frequency of Wikidata entities (via CLOCQ).
+    Lookups are cached in a persistent cache, which is bounded in size:
+    least recently used entries are dropped first.
+    Bulk lookups deduplicate the given QIDs and only query CLOCQ for unseen ones.
+    """
+
+    def __init__(self, config, clocq):
+        self.config = config
+        self.logger = get_logger(__name__, config)
+        self.tracer = get_tracer(config)
+        self.clocq = clocq
+        self.cache_path = os.path.join(self.config["data_path"], self.config["entity_metadata_cache_file"])
+        self.cache_size = self.config["entity_metadata_cache_size"]
+        # number of concurrent CLOCQ requests in bulk lookups
+        self.workers = self.config["entity_metadata_workers"]
+
+        self.lock = threading.RLock()
+        self._init_cache()
+        self.cache_changed = False
+
+    def get_type(self, qid):
+        """Most specific type of the entity ({"id": .., "label": ..}), or None."""
+        return self._lookup("type", qid)
+
+    def get_types(self, qid):
+        """All types of the entity."""
+        return self._lookup("types", qid)
+
+    def get_frequency(self, qid):
+        """Frequency of the entity as [subject frequency, object frequency]."""
+        return self._lookup("frequency", qid)
+
+    def get_type_bulk(self, qids):
+        return self._lookup_bulk("type", qids)
+
+    def get_types_bulk(self, qids):
+        return self._lookup_bulk("types", qids)
+
+    def get_frequency_bulk(self, qids):
+        return self._lookup_bulk("frequency", qids)
+
+    def _lookup(self, kind, qid):
+        key = (kind, qid)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        value = self._query_clocq(key)
+        with self.lock:
+            self._add(key, value)
+        return value
+
+    def _lookup_bulk(self, kind, qids):
+        """Return a dictionary from each of the given QIDs to its metadata."""
+        result = dict()
+        missing = list()
+        with self.lock:
+            for qid in dict.fromkeys(qids):
+                key = (kind, qid)
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    result[qid] = self.cache[key]
+                else:
+                    missing.append(key)
+        if not missing:
+            return result
+
+        start = time.time()
+        values = fetch_concurrently(self.tracer.bind(self._query_clocq), missing, self.workers)
+        with self.lock:
+            for key, value in zip(missing, values):
+                self._add(key, value)
+                result[key[1]] = value
+        self.logger.debug(f"Retrieved {kind} for {len(missing)} entities in {time.time() - start} seconds.")
+        return result
+
+    def _query_clocq(self, key):
+        kind, qid = key
+        with self.tracer.span("clocq", call=kind):
+            if kind == "type":
+                return self.clocq.get_type(qid)
+            elif kind == "types":
+                return self.clocq.get_types(qid)
+            return self.clocq.get_frequency(qid)
+
+    def _add(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        self.cache_changed = True
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def store_cache(self):
+        """Store the cache to disk."""
+        if not self.cache_changed:  # store only if cache changed
+            return
+        # the version is checked under the file lock, such that no other process
+        # can write the cache between the check and the write
+        with self.lock, FileLock(f"{self.cache_path}.lock"):
+            # check if the cache was updated by other processes
+            if self._read_cache_version() == self.cache_version:
+                # no updates: store and update version
+                self.logger.info(f"Writing entity metadata cache at path {self.cache_path}.")
+            else:
+                # update! read updated version and merge the caches
+                self.logger.info(f"Merging entity metadata cache at path {self.cache_path}.")
+                updated_cache = self._read_cache()
+                # overwrite with changes in current process (most recent)
+                for key, value in self.cache.items():
+                    updated_cache[key] = value
+                    updated_cache.move_to_end(key)
+                while len(updated_cache) > self.cache_size:
+                    updated_cache.popitem(last=False)
+                self.cache = updated_cache
+            # store
+            self._write_cache(self.cache)
+            self._write_cache_version()
+            self.cache_changed = False
+
+    def _init_cache(self):
+        """Initialize the cache."""
+        if os.path.isfile(self.cache_path):
+            # remember version read initially
+            self.logger.info(f"Loading entity metadata cache from path {self.cache_path}.")
+            with FileLock(f"{self.cache_path}.lock"):
+                self.cache_version = self._read_cache_version()
+                self.cache = self._read_cache()
+            self.logger.info(f"Entity metadata cache successfully loaded.")
+        else:
+            self.logger.info(f"Could not find an existing entity metadata cache at path {self.cache_path}.")
+            self.logger.info("Populating entity metadata cache from scratch!")
+            self.cache = OrderedDict()
+            with FileLock(f"{self.cache_path}.lock"):
+                self._write_cache(self.cache)
+                self._write_cache_version()
+
+    def _read_cache(self):
+        """
+        Read the current version of the cache.
+        This can be different from the version used in this file,
+        given that multiple processes may access it simultaneously.
+        """
+        with open(self.cache_path, "rb") as fp:
+            cache = pickle.load(fp)
+        return cache
+
+    def _write_cache(self, cache):
+        """Write to the cache."""
+        cache_dir = os.path.dirname(self.cache_path)
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        with open(self.cache_path, "wb") as fp:
+            pickle.dump(cache, fp)
+        return cache
+
+    def _read_cache_version(self):
+        """Read the cache version (hashed timestamp of last update) from a dedicated file."""
+        if not os.path.isfile(f"{self.cache_path}.version"):
+            self._write_cache_version()
+        with open(f"{self.cache_path}.version", "r") as fp:
+            cache_version = fp.readline().strip()
+        return cache_version
+
+    def _write_cache_version(self):
+        """Write the current cache version (hashed timestamp of current update)."""
+        with open(f"{self.cache_path}.version", "w") as fp:
+            version = str(time.time())
+            fp.write(version)
+        self.cache_version = version
@@ -0,0 +1,181 @@
+"""
+Library for issuing HTTP requests against Wikipedia and related services.
+All requests of a process go through one pooled HttpClient.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tiq.library.tracing import get_tracer
+
+# status codes indicating a transient problem on the server side
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+USER_AGENT = "TIQ-benchmark-construction (https://github.com/zhenjia2017/TIQ)"
+
+logger = logging.getLogger(__name__)
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+class HostRateLimiter:
+    """
+    Limit the number of requests per second sent to each host.
+    One instance is shared by all threads of a process.
+    """
+
+    def __init__(self, requests_per_second):
+        self.min_interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = dict()
+
+    def wait(self, url):
+        """Block until the next request to the host of the given url is allowed."""
+        if not self.min_interval:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class HttpClient:
+    """
+    HTTP client with keep-alive connection pooling, timeouts,
+    retries with exponential backoff on 429/5xx and connection errors,
+    and request counters per endpoint.
+    """
+
+    def __init__(self, pool_size=32, timeout=30, max_retries=5, backoff_factor=0.5, requests_per_second=0):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+
+        self.pool_size = pool_size
+        self.session_lock = threading.Lock()
+        self.session = None
+        self.session_pid = None
+
+        self.counters = defaultdict(Counter)
+        self.counter_lock = threading.Lock()
+        self.tracer = get_tracer()
+
+    def _session(self):
+        """
+        Return the session of the current process.
+        Pooled connections must not be shared with forked processes,
+        so each process creates its own session.
+        """
+        with self.session_lock:
+            if self.session is None or self.session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"User-Agent": USER_AGENT})
+                self.session = session
+                self.session_pid = os.getpid()
+            return self.session
+
+    def get(self, url, params=None, endpoint="default"):
+        """
+        Issue a GET request. Returns the response, or None if the
+        request still failed after all retries.
+        """
+        with self.tracer.span("http", endpoint=endpoint):
+            return self._get(url, params, endpoint)
+
+    def _get(self, url, params, endpoint):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait(url)
+            start = time.time()
+            response = None
+            try:
+                response = self._session().get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = e
+            self._count(endpoint, "requests", seconds=time.time() - start)
+
+            if response is not None:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                error = f"HTTP status {response.status_code}"
+
+            if attempt < self.max_retries:
+                self._count(endpoint, "retries")
+                time.sleep(self._backoff_delay(attempt, response))
+
+        self._count(endpoint, "failures")
+        logger.warning(f"Request to {endpoint} failed after {self.max_retries} retries ({error}): {url}")
+        return None
+
+    def get_json(self, url, params=None, endpoint="default"):
+        """Issue a GET request and decode the JSON body. Returns None on failure."""
+        response = self.get(url, params=params, endpoint=endpoint)
+        if response is None:
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            self._count(endpoint, "invalid_responses")
+            logger.warning(f"Invalid JSON response from {endpoint}: {url}")
+            return None
+
+    def statistics(self):
+        """Return a copy of the counters per endpoint."""
+        with self.counter_lock:
+            return {endpoint: dict(counter) for endpoint, counter in self.counters.items()}
+
+    def _backoff_delay(self, attempt, response):
+        # respect the delay requested by the server (e.g. for 429 Too Many Requests)
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return float(response.headers["Retry-After"])
+        return self.backoff_factor * (2 ** attempt)
+
+    def _count(self, endpoint, name, seconds=None):
+        with self.counter_lock:
+            self.counters[endpoint][name] += 1
+            if seconds is not None:
+                self.counters[endpoint]["seconds"] += seconds
+
+
+def get_http_client(config=None):
+    """
+    Return the HTTP client shared within the process.
+    The client is created on the first call, using the given config (if any).
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            if config:
+                _http_client = HttpClient(pool_size=config["http_pool_size"],
+                                          timeout=config["http_timeout"],
+                                          max_retries=config["http_max_retries"],
+                                          backoff_factor=config["http_backoff_factor"],
+                                          requests_per_second=config["requests_per_second_per_host"])
+            else:
+                _http_client = HttpClient()
+        return _http_client
+
+
+def fetch_concurrently(fetch_function, items, max_workers):
+    """
+    Apply the fetch function to all items using a bounded thread pool.
+    The results are returned in the order of the given items.
+    """
+    if max_workers <= 1 or len(items) <= 1:
+        return [fetch_function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fetch_function, items))
@@ -0,0 +1,193 @@
+"""
+Key-value store on top of SQLite, used for caches which are shared
+between threads and pipeline processes.
+Values are pickled, reads are lazy (per key) and writes are incremental.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# seconds to wait for a lock held by another process
+SQLITE_TIMEOUT = 120
+_MISSING = object()
+# maximum number of variables in a single query (limit of older SQLite versions: 999)
+MAX_QUERY_VARIABLES = 500
+# bounded stores: accesses are written in batches of this size (or with the next write)
+ACCESS_FLUSH_SIZE = 10000
+# bounded stores: the entries are counted after this number of inserted rows at the latest
+# (other processes insert as well), and evicted down to this share of the maximum size
+EVICTION_CHECK_ROWS = 10000
+EVICTION_TARGET_RATIO = 0.9
+
+
+class SqliteStore:
+    SCHEMA = "key TEXT PRIMARY KEY, value BLOB"
+
+    def __init__(self, path, table="store"):
+        self.path = path
+        self.table = table
+        Path(os.path.dirname(os.path.abspath(path))).mkdir(parents=True, exist_ok=True)
+        self.local = threading.local()
+        self._connection().execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ({self.SCHEMA})")
+
+    def _connection(self):
+        """
+        Return the connection of the current thread.
+        Connections are never shared between threads or (forked) processes.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+            # write-ahead logging: readers do not block the (single) writer
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def get(self, key, default=None):
+        row = self._connection().execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        self._connection().execute(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                                   (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def put_many(self, items):
+        """Store all (key, value) pairs in a single transaction."""
+        rows = [(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)) for key, value in items]
+        if not rows:
+            return
+        self._transaction((f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)", rows))
+
+    def _transaction(self, *statements):
+        """Execute the given (statement, rows) pairs in a single transaction."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for statement, rows in statements:
+                connection.executemany(statement, rows)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def keys(self):
+        return [row[0] for row in self._connection().execute(f"SELECT key FROM {self.table}")]
+
+    def items(self):
+        rows = self._connection().execute(f"SELECT key, value FROM {self.table}")
+        return [(key, pickle.loads(value)) for key, value in rows]
+
+    def __contains__(self, key):
+        row = self._connection().execute(f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return row is not None
+
+    def __getitem__(self, key):
+        value = self.get(key, default=_MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __len__(self):
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class BoundedSqliteStore(SqliteStore):
+    """
+    Store with a maximum number of entries.
+    The time of the last access is kept per entry, and the least recently
+    used entries are evicted once the store grows beyond its maximum size.
+    Accesses are collected in memory and written together with the next write
+    (reads do not take the write lock), and the entries are counted only when
+    the store might have grown beyond its maximum size: the bound is approximate.
+    """
+    SCHEMA = "key TEXT PRIMARY KEY, value BLOB, last_access REAL"
+
+    def __init__(self, path, table="store", max_size=1000000):
+        super().__init__(path, table)
+        self.max_size = max_size
+        self._connection().execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table} (last_access)")
+        self.lock = threading.Lock()
+        # key -> time of the last access, not yet written
+        self.accesses = dict()
+        # entries counted last time (plus the rows inserted since then by this process)
+        self.estimated_size = len(self)
+        self.rows_since_count = 0
+
+    def get_many(self, keys):
+        """
+        Return a dictionary with the values of the given keys which are in the store.
+        The entries found are marked as accessed.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = dict()
+        connection = self._connection()
+        for i in range(0, len(keys), MAX_QUERY_VARIABLES):
+            chunk = keys[i:i + MAX_QUERY_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            rows = connection.execute(f"SELECT key, value FROM {self.table} WHERE key IN ({placeholders})", chunk)
+            for key, value in rows:
+                found[key] = pickle.loads(value)
+        if found:
+            now = time.time()
+            with self.lock:
+                for key in found:
+                    self.accesses[key] = now
+                flush = len(self.accesses) >= ACCESS_FLUSH_SIZE
+            if flush:
+                self.flush()
+        return found
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        """Store all (key, value) pairs in a single transaction, and evict entries if required."""
+        now = time.time()
+        rows = [(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now) for key, value in items]
+        if not rows:
+            return
+        self._transaction(
+            (f"INSERT OR REPLACE INTO {self.table} (key, value, last_access) VALUES (?, ?, ?)", rows),
+            self._access_statement())
+        with self.lock:
+            self.estimated_size += len(rows)
+            self.rows_since_count += len(rows)
+            check = self.estimated_size > self.max_size or self.rows_since_count >= EVICTION_CHECK_ROWS
+        if check:
+            self.evict()
+
+    def flush(self):
+        """Write the accesses collected so far."""
+        self._transaction(self._access_statement())
+
+    def _access_statement(self):
+        with self.lock:
+            accesses, self.accesses = self.accesses, dict()
+        return (f"UPDATE {self.table} SET last_access = ? WHERE key = ?",
+                [(access, key) for key, access in accesses.items()])
+
+    def evict(self):
+        """Remove the least recently used entries if the store exceeds the maximum size."""
+        size = len(self)
+        # evict a bit more than required, such that the entries are not counted again on the next write
+        excess = size - int(self.max_size * EVICTION_TARGET_RATIO) if size > self.max_size else 0
+        if excess > 0:
+            self.flush()
+            self._connection().execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY last_access LIMIT ?)", (excess,))
+        with self.lock:
+            self.estimated_size = size - max(excess, 0)
+            self.rows_since_count = 0
@@ -0,0 +1,76 @@
+"""
+Execution of pipeline steps with content-addressed artifacts.
+
+A step is identified by a fingerprint of its name, the contents of its input files,
+the config values it depends on, and further parameters.
+The output of a step is stored under its fingerprint (pickled), and a step whose
+fingerprint already has an artifact is skipped: the stored output is returned instead.
+Changing a config value thus re-runs only the steps depending on it (and the steps
+whose input files change as a consequence).
+"""
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+
+from tiq.library.utils import get_logger
+
+# increase when the outputs of the steps change, such that existing artifacts are not used anymore
+STAGE_ARTIFACT_VERSION = 1
+# read input files in blocks of this size for hashing
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class StageRunner:
+    def __init__(self, config):
+        self.config = config
+        self.logger = get_logger(__name__, config)
+        self.use_artifacts = self.config["stage_artifacts_use_cache"]
+        self.artifact_dir = os.path.join(self.config["result_path"], self.config["stage_artifact_dir"])
+        # (path, size, modification time) -> content hash, input files recur across steps
+        self.file_hashes = dict()
+
+    def run(self, name, function, input_files=(), config_keys=(), params=None):
+        """
+        Run the step with the given name (function without arguments), or return
+        the output of an earlier run with the same input files, config values and parameters.
+        """
+        if not self.use_artifacts:
+            return function()
+        fingerprint = self.fingerprint(name, input_files, config_keys, params)
+        artifact_path = os.path.join(self.artifact_dir, name, f"{fingerprint}.pickle")
+        if os.path.isfile(artifact_path):
+            self.logger.info(f"Skipping step {name}: artifact {artifact_path} exists.")
+            with open(artifact_path, "rb") as fp:
+                return pickle.load(fp)
+
+        output = function()
+        Path(os.path.dirname(artifact_path)).mkdir(parents=True, exist_ok=True)
+        # write and replace, such that other processes never read a partial artifact
+        tmp_path = f"{artifact_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as fp:
+            pickle.dump(output, fp)
+        os.replace(tmp_path, artifact_path)
+        return output
+
+    def fingerprint(self, name, input_files=(), config_keys=(), params=None):
+        fingerprint = hashlib.sha1()
+        fingerprint.update(f"{STAGE_ARTIFACT_VERSION}\0{name}\0".encode("utf-8"))
+        for path in input_files:
+            fingerprint.update(self._file_hash(path).encode("utf-8"))
+        config_values = {key: self.config[key] for key in config_keys}
+        fingerprint.update(json.dumps(config_values, sort_keys=True, default=str).encode("utf-8"))
+        fingerprint.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        return fingerprint.hexdigest()
+
+    def _file_hash(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if key not in self.file_hashes:
+            file_hash = hashlib.sha1()
+            with open(path, "rb") as fp:
+                for block in iter(lambda: fp.read(HASH_BLOCK_SIZE), b""):
+                    file_hash.update(block)
+            self.file_hashes[key] = file_hash.hexdigest()
+        return self.file_hashes[key]
@@ -1,6 +1,9 @@
 # from sutime import SUTime
+import multiprocessing
+import os
 import re
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 REGEX_NUM_YEAR_PATTERN = re.compile("^[0-9][0-9][0-9][0-9]$")
 REGEX_NUM_YMD_PATTERN = re.compile("^\d{4}([-|/|.]\d{1,2})([-|/|.]\d{1,2})$")
@@ -33,6 +36,66 @@ REGEX_TEXT_DATE_PATTERN_TIMESPAN5 = re.compile(
 REGEX_TEXT_DATE_PATTERN_TIMESPAN6 = re.compile(
     r"\w+\s\d{1,2},\s\d{4}\s\u2013\s\w+\s\d{1,2},\s\d{4}")  # May 29, 2000 \u2013 July 13, 2000
 
+# every date (in text or number format) has four consecutive digits
+REGEX_YEAR_DIGITS_PATTERN = re.compile(r"\d{4}")
+REGEX_NUM_SEPARATOR_PATTERN = re.compile(r"[-|.|/]")
+PUNCTUATIONS = ['.', ';', '(', ')', '[', ']', ',']
+
+MONTH_TO_NUMBER = {
+    "january": "01",
+    "jan": "01",
+    "february": "02",
+    "feb": "02",
+    "march": "03",
+    "mar": "03",
+    "april": "04",
+    "apr": "04",
+    "may": "05",
+    "june": "06",
+    "jun": "06",
+    "july": "07",
+    "jul": "07",
+    "august": "08",
+    "aug": "08",
+    "september": "09",
+    "sep": "09",
+    "october": "10",
+    "oct": "10",
+    "november": "11",
+    "nov": "11",
+    "december": "12",
+    "dec": "12",
+}
+NUMBER_TO_MONTH = {
+    "01": "January",
+    "02": "February",
+    "03": "March",
+    "04": "April",
+    "05": "May",
+    "06": "June",
+    "07": "July",
+    "08": "August",
+    "09": "September",
+    "10": "October",
+    "11": "November",
+    "12": "December",
+}
+
+# dates in text format: (pattern, date format, characters required in the text for a match)
+# the patterns are applied in this order, later annotations with the same span replace earlier ones
+TEXT_DATE_PATTERNS = [
+    (REGEX_TEXT_DMY_PATTERN, "dmy", ()),
+    (REGEX_TEXT_DATE_PATTERN_TIMESPAN1, "timespan1", (",",)),
+    (REGEX_TEXT_DATE_PATTERN_TIMESPAN2, "timespan2", ("\u2013",)),
+    (REGEX_TEXT_DATE_PATTERN_TIMESPAN3, "timespan3", (",", "\u2013")),
+    (REGEX_TEXT_DATE_PATTERN_TIMESPAN4, "timespan4", ("\u2013",)),
+    (REGEX_TEXT_DATE_PATTERN_TIMESPAN5, "timespan5", ("\u2013",)),
+    (REGEX_TEXT_DATE_PATTERN_TIMESPAN6, "timespan6", (",", "\u2013")),
+    (REGEX_TEXT_MY_PATTERN, "my", ()),
+    (REGEX_TEXT_YMD_PATTERN, "ymd", (",",)),
+    (REGEX_TEXT_MDY_PATTERN, "mdy", (",",)),
+]
+
 TIMESTAMP_PATTERN_1 = re.compile('^"[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T00:00:00Z"')
 TIMESTAMP_PATTERN_2 = re.compile("^[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T00:00:00Z")
 TIMESTAMP_PATTERN_3 = re.compile("^[-][0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T00:00:00Z")
@@ -303,23 +366,18 @@ class SutimeDate:
 
 
 class RegexpAnnotator:
+    def __init__(self, processes=1, chunk_size=128):
+        # batches are annotated in chunks by a pool of worker processes (regex matching is CPU-bound)
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.pool = None
+        self.pool_pid = None
+        self.pool_lock = threading.Lock()
+
     @staticmethod
     def convert_number_to_month(number):
         """Map the given month to a number."""
-        return {
-            "01": "January",
-            "02": "February",
-            "03": "March",
-            "04": "April",
-            "05": "May",
-            "06": "June",
-            "07": "July",
-            "08": "August",
-            "09": "September",
-            "10": "October",
-            "11": "November",
-            "12": "December",
-        }[number]
+        return NUMBER_TO_MONTH[number]
 
     @staticmethod
     def is_date(string):
@@ -369,55 +427,13 @@ class RegexpAnnotator:
     @staticmethod
     def convert_date_to_timestamp(date, date_format="dmy"):
         """Convert a date from the Wikidata frontendstyle to timestamp style."""
-        if date_format == "dmy":
-            return RegexpAnnotator._convert_dmy_to_timestamp(date)
-        elif date_format == "ymd":
-            return RegexpAnnotator._convert_ymd_to_timestamp(date)
-        elif date_format == "timespan1":
-            return RegexpAnnotator._convert_timespan1_to_timestamp(date)
-        elif date_format == "timespan2":
-            return RegexpAnnotator._convert_timespan2_to_timestamp(date)
-        elif date_format == "timespan3":
-            return RegexpAnnotator._convert_timespan3_to_timestamp(date)
-        elif date_format == "timespan4":
-            return RegexpAnnotator._convert_timespan4_to_timestamp(date)
-        elif date_format == "timespan5":
-            return RegexpAnnotator._convert_timespan5_to_timestamp(date)
-        elif date_format == "timespan6":
-            return RegexpAnnotator._convert_timespan6_to_timestamp(date)
-        elif date_format == "my":
-            return RegexpAnnotator._convert_my_to_timestamp(date)
-        else:
-            return RegexpAnnotator._convert_mdy_to_timestamp(date)
+        converter = DATE_CONVERTERS.get(date_format, RegexpAnnotator._convert_mdy_to_timestamp)
+        return converter(date)
 
     @staticmethod
     def convert_month_to_number(month):
         """Map the given month to a number."""
-        return {
-            "january": "01",
-            "jan": "01",
-            "february": "02",
-            "feb": "02",
-            "march": "03",
-            "mar": "03",
-            "april": "04",
-            "apr": "04",
-            "may": "05",
-            "june": "06",
-            "jun": "06",
-            "july": "07",
-            "jul": "07",
-            "august": "08",
-            "aug": "08",
-            "september": "09",
-            "sep": "09",
-            "october": "10",
-            "oct": "10",
-            "november": "11",
-            "nov": "11",
-            "december": "12",
-            "dec": "12",
-        }[month.lower()]
+        return MONTH_TO_NUMBER[month.lower()]
 
     @staticmethod
     def _convert_dmy_to_timestamp(date):
@@ -788,8 +804,7 @@ class RegexpAnnotator:
             return timestamp
 
     def remove_punctuation_in_token(self, token):
-        punctuations = ['.', ';', '(', ')', '[', ']', ',']
-        for punc in punctuations:
+        for punc in PUNCTUATIONS:
             token = token.rstrip(punc)
             token = token.lstrip(punc)
         return token
@@ -818,246 +833,113 @@ class RegexpAnnotator:
 
     def extract_dates_in_text_format(self, string):
         date_norms = []
-        # dates in dmy format
-        dmy_dates = re.findall(REGEX_TEXT_DMY_PATTERN, string)
-
-        for match in dmy_dates:
-            patt_start = string.index(match)
-            patt_end = patt_start + len(match)
-            result = RegexpAnnotator.convert_date_to_timestamp(match, date_format="dmy")
-            if result:
-                date = result[0]
-                timestamp = result[1]
-                date_normalization = DateNormalization(
-                    {'text': match, 'span': (patt_start, patt_end), 'timespan': (timestamp, timestamp),
-                     'method': 'regex',
-                     'disambiguation': [(date, timestamp)]})
-                date_norms.append(date_normalization)
-
-        # two dates in timespan1 format
-        timespan1 = re.findall(REGEX_TEXT_DATE_PATTERN_TIMESPAN1, string)
-        for match in timespan1:
-            patt_start = string.index(match)
-            patt_end = patt_start + len(match)
-            result = RegexpAnnotator.convert_date_to_timestamp(match, date_format="timespan1")
-            # timestamp1_str, timestamp1, timestamp2_str, timestamp2
-            if result:
-                date1 = result[0]
-                timestamp1 = result[1]
-                date2 = result[2]
-                timestamp2 = result[3]
-                date_normalization = DateNormalization(
-                    {'text': match, 'span': (patt_start, patt_end), 'timespan': (timestamp1, timestamp2),
-                     'method': 'regex',
-                     'disambiguation': [(date1, timestamp1), (date2, timestamp2)]})
-                date_norms.append(date_normalization)
-
-        # two dates in timespan2 format
-        timespan2 = re.findall(REGEX_TEXT_DATE_PATTERN_TIMESPAN2, string)
-        for match in timespan2:
-            patt_start = string.index(match)
-            patt_end = patt_start + len(match)
-            result = RegexpAnnotator.convert_date_to_timestamp(match, date_format="timespan2")
-            if result:
-                date1 = result[0]
-                timestamp1 = result[1]
-                date2 = result[2]
-                timestamp2 = result[3]
-                date_normalization = DateNormalization(
-                    {'text': match, 'span': (patt_start, patt_end), 'timespan': (timestamp1, timestamp2),
-                     'method': 'regex',
-                     'disambiguation': [(date1, timestamp1), (date2, timestamp2)]})
-                date_norms.append(date_normalization)
-
-        # two dates in timespan3 format
-        timespan3 = re.findall(REGEX_TEXT_DATE_PATTERN_TIMESPAN3, string)
-        for match in timespan3:
-            patt_start = string.index(match)
-            patt_end = patt_start + len(match)
-            result = RegexpAnnotator.convert_date_to_timestamp(match, date_format="timespan3")
-            if result:
-                date1 = result[0]
-                timestamp1 = result[1]
-                date2 = result[2]
-                timestamp2 = result[3]
-                date_normalization = DateNormalization(
-                    {'text': match, 'span': (patt_start, patt_end), 'timespan': (timestamp1, timestamp2),
-                     'method': 'regex',
-                     'disambiguation': [(date1, timestamp1), (date2, timestamp2)]})
-                date_norms.append(date_normalization)
-
-        # two dates in timespan4 format
-        timespan4 = re.findall(REGEX_TEXT_DATE_PATTERN_TIMESPAN4, string)
-        for match in timespan4:
-            patt_start = string.index(match)
-            patt_end = patt_start + len(match)
-            result = RegexpAnnotator.convert_date_to_timestamp(match, date_format="timespan4")
-            if result:
-                date1 = result[0]
-                timestamp1 = result[1]
-                date2 = result[2]
-                timestamp2 = result[3]
-                date_normalization = DateNormalization(
-                    {'text': match, 'span': (patt_start, patt_end), 'timespan': (timestamp1, timestamp2),
-                     'method': 'regex',
-                     'disambiguation': [(date1, timestamp1), (date2, timestamp2)]})
-                date_norms.append(date_normalization)
-
-        # two dates in timespan5 format
-        timespan5 = re.findall(REGEX_TEXT_DATE_PATTERN_TIMESPAN5, string)
-        for match in timespan5:
-            patt_start = string.index(match)
-            patt_end = patt_start + len(match)
-            result = RegexpAnnotator.convert_date_to_timestamp(match, date_format="timespan5")
-            if result:
-                date1 = result[0]
-                timestamp1 = result[1]
-                date2 = result[2]
-                timestamp2 = result[3]
-                date_normalization = DateNormalization(
-                    {'text': match, 'span': (patt_start, patt_end), 'timespan': (timestamp1, timestamp2),
-                     'method': 'regex',
-                     'disambiguation': [(date1, timestamp1), (date2, timestamp2)]})
-                date_norms.append(date_normalization)
-
-        # two dates in timespan6 format
-        timespan6 = re.findall(REGEX_TEXT_DATE_PATTERN_TIMESPAN6, string)
-        for match in timespan6:
-            patt_start = string.index(match)
-            patt_end = patt_start + len(match)
-            result = RegexpAnnotator.convert_date_to_timestamp(match, date_format="timespan6")
-            if result:
-                date1 = result[0]
-                timestamp1 = result[1]
-                date2 = result[2]
-                timestamp2 = result[3]
-                date_normalization = DateNormalization(
-                    {'text': match, 'span': (patt_start, patt_end), 'timespan': (timestamp1, timestamp2),
-                     'method': 'regex',
-                     'disambiguation': [(date1, timestamp1), (date2, timestamp2)]})
-                date_norms.append(date_normalization)
-
-        # month year format
-        monthyear = re.findall(REGEX_TEXT_MY_PATTERN, string)
-        for match in monthyear:
-            patt_start = string.index(match)
-            patt_end = patt_start + len(match)
-            result = RegexpAnnotator.convert_date_to_timestamp(match, date_format="my")
-            if result:
-                date1 = result[0]
-                timestamp1 = result[1]
-                date2 = result[2]
-                timestamp2 = result[3]
-                date_normalization = DateNormalization(
-                    {'text': match, 'span': (patt_start, patt_end), 'timespan': (timestamp1, timestamp2),
-                     'method': 'regex',
-                     'disambiguation': [(date1, timestamp1)]})
-                date_norms.append(date_normalization)
-
-        # dates in ymd format
-        ymd_dates = re.findall(REGEX_TEXT_YMD_PATTERN, string)
-        for match in ymd_dates:
-            patt_start = string.index(match)
-            patt_end = patt_start + len(match)
-            result = RegexpAnnotator.convert_date_to_timestamp(match, date_format="ymd")
-            if result:
-                date = result[0]
-                timestamp = result[1]
-                date_normalization = DateNormalization(
-                    {'text': match, 'span': (patt_start, patt_end), 'timespan': (timestamp, timestamp),
-                     'method': 'regex',
-                     'disambiguation': [(date, timestamp)]})
-                date_norms.append(date_normalization)
-
-        # dates in mdy format
-        mdy_dates = re.findall(REGEX_TEXT_MDY_PATTERN, string)
-        for match in mdy_dates:
-            patt_start = string.index(match)
-            patt_end = patt_start + len(match)
-            result = RegexpAnnotator.convert_date_to_timestamp(match, date_format="mdy")
-            if result:
-                date = result[0]
-                timestamp = result[1]
-                date_normalization = DateNormalization(
-                    {'text': match, 'span': (patt_start, patt_end), 'timespan': (timestamp, timestamp),
-                     'method': 'regex',
-                     'disambiguation': [(date, timestamp)]})
-                date_norms.append(date_normalization)
-
-        return [w.json_dict() for w in date_norms]
+        for pattern, date_format, required in TEXT_DATE_PATTERNS:
+            # patterns with separators not occurring in the string cannot match
+            if any(char not in string for char in required):
+                continue
+            convert = DATE_CONVERTERS[date_format]
+            for match in pattern.findall(string):
+                result = convert(match)
+                if not result:
+                    continue
+                patt_start = string.index(match)
+                span = (patt_start, patt_start + len(match))
+                if len(result) == 2:
+                    # single date
+                    date, timestamp = result
+                    date_norms.append(
+                        self._date_normalization(match, span, (timestamp, timestamp), [(date, timestamp)]))
+                elif date_format == "my":
+                    # month: only the first day is used for the disambiguation
+                    date1, timestamp1, _, timestamp2 = result
+                    date_norms.append(
+                        self._date_normalization(match, span, (timestamp1, timestamp2), [(date1, timestamp1)]))
+                else:
+                    # two dates (timespan)
+                    date1, timestamp1, date2, timestamp2 = result
+                    date_norms.append(self._date_normalization(match, span, (timestamp1, timestamp2),
+                                                               [(date1, timestamp1), (date2, timestamp2)]))
+        return date_norms
 
     def extract_date_in_num_format(self, string):
         date_norms = []
         tokens = string.split(" ")
         for token in tokens:
+            # tokens without a year cannot be dates
+            if not REGEX_YEAR_DIGITS_PATTERN.search(token):
+                continue
             token_withno_punc = self.remove_punctuation_in_token(token)
             token_start = string.index(token_withno_punc)
-            token_end = token_start + len(token_withno_punc)
+            span = (token_start, token_start + len(token_withno_punc))
 
             if REGEX_NUM_YEAR_PATTERN.match(token_withno_punc):
                 timestamp = RegexpAnnotator.convert_year_to_timestamp(token_withno_punc)
-                date_normalization = DateNormalization(
-                    {'text': token_withno_punc, 'span': (token_start, token_end),
-                     'timespan': (timestamp, f"{token_withno_punc}-12-31T00:00:00Z"),
-                     'method': 'regex',
-                     'disambiguation': [(token_withno_punc, timestamp)]})
-                date_norms.append(date_normalization)
+                date_norms.append(self._date_normalization(
+                    token_withno_punc, span, (timestamp, f"{token_withno_punc}-12-31T00:00:00Z"),
+                    [(token_withno_punc, timestamp)]))
 
             if REGEX_NUM_YMD_PATTERN.match(token_withno_punc):
-                year = re.split(r'[-|.|/]', token_withno_punc)[0]
-                mm = re.split(r'[-|.|/]', token_withno_punc)[1]
-                dd = re.split(r'[-|.|/]', token_withno_punc)[2]
+                year, mm, dd = REGEX_NUM_SEPARATOR_PATTERN.split(token_withno_punc)[:3]
                 result = self.normalize_ymd_date_pattern(year, mm, dd)
-                if result:
-                    date = result[0]
-                    timespan = result[1]
-                    timestamp = timespan[0]
-                    date_normalization = DateNormalization(
-                        {'text': token_withno_punc, 'span': (token_start, token_end), 'timespan': timespan,
-                         'method': 'regex',
-                         'disambiguation': [(date, timestamp)]})
-                    date_norms.append(date_normalization)
-
             elif REGEX_NUM_MDY_PATTERN.match(token_withno_punc):
-                year = re.split(r'[-|.|/]', token_withno_punc)[2]
-                mm = re.split(r'[-|.|/]', token_withno_punc)[0]
-                dd = re.split(r'[-|.|/]', token_withno_punc)[1]
+                mm, dd, year = REGEX_NUM_SEPARATOR_PATTERN.split(token_withno_punc)[:3]
                 result = self.normalize_ymd_date_pattern(year, mm, dd)
-                if result:
-                    date = result[0]
-                    timespan = result[1]
-                    timestamp = timespan[0]
-                    date_normalization = DateNormalization(
-                        {'text': token_withno_punc, 'span': (token_start, token_end), 'timespan': timespan,
-                         'method': 'regex',
-                         'disambiguation': [(date, timestamp)]})
-                    date_norms.append(date_normalization)
-
-                else:
-                    year = re.split(r'[-|.|/]', token)[2]
-                    mm = re.split(r'[-|.|/]', token)[1]
-                    dd = re.split(r'[-|.|/]', token)[0]
+                if not result:
+                    # dmy format
+                    dd, mm, year = REGEX_NUM_SEPARATOR_PATTERN.split(token)[:3]
                     result = self.normalize_ymd_date_pattern(year, mm, dd)
-                    if result:
-                        date = result[0]
-                        timespan = result[1]
-                        timestamp = timespan[0]
-                        date_normalization = DateNormalization(
-                            {'text': token_withno_punc, 'span': (token_start, token_end), 'timespan': timespan,
-                             'method': 'regex',
-                             'disambiguation': [(date, timestamp)]})
-                        date_norms.append(date_normalization)
-
-        return [w.json_dict() for w in date_norms]
-
-    # multithread annotate sentences using regular expression and normalize them into standard format
+            else:
+                continue
+            if result:
+                date, timespan = result
+                date_norms.append(self._date_normalization(token_withno_punc, span, timespan, [(date, timespan[0])]))
+        return date_norms
+
+    @staticmethod
+    def _date_normalization(text, span, timespan, disambiguation):
+        return DateNormalization(
+            {'text': text, 'span': span, 'timespan': timespan, 'method': 'regex',
+             'disambiguation': disambiguation}).json_dict()
+
+    # annotate sentences using regular expression and normalize them into standard format
+    # (the annotation is CPU-bound: threads do not speed it up)
     def regex_annotation_normalization_multithreading(self, string_refers):
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            annotation_sentences = [future.result()
-                                    for future in [executor.submit(self.regex_annotation_normalization, string)
-                                                   for string, reference_time in string_refers
-                                                   ]]
-        return annotation_sentences
+        return self.regex_annotation_normalization_batch([string for string, reference_time in string_refers])
+
+    def regex_annotation_normalization_batch(self, strings):
+        """
+        Annotate the given list of strings, returns one list of annotations per string.
+        Large batches are split into chunks, which are annotated by worker processes.
+        """
+        if self.processes <= 1 or len(strings) <= self.chunk_size:
+            return [self.regex_annotation_normalization(string) for string in strings]
+        chunks = [strings[i:i + self.chunk_size] for i in range(0, len(strings), self.chunk_size)]
+        results = list()
+        for chunk_result in self._pool().map(_annotate_chunk, chunks):
+            # workers return compact tuples, which are expanded here
+            results += [[self._date_normalization(*annotation) for annotation in annotations]
+                        for annotations in chunk_result]
+        return results
+
+    def _pool(self):
+        """
+        Worker processes are started on first use (with spawn: the pipeline runs threads).
+        A forked process cannot use the pool of its parent, and starts its own pool.
+        """
+        with self.pool_lock:
+            if self.pool is None or self.pool_pid != os.getpid():
+                self.pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                mp_context=multiprocessing.get_context("spawn"))
+                self.pool_pid = os.getpid()
+            return self.pool
+
+    def shutdown(self):
+        """Stop the worker processes (restarted on the next use of the pool)."""
+        with self.pool_lock:
+            if self.pool is not None and self.pool_pid == os.getpid():
+                self.pool.shutdown()
+            self.pool = None
+            self.pool_pid = None
 
     # annotate sentences using regular expression and normalize them into standard format
     def regex_annotation_normalization(self, string):
@@ -1067,7 +949,8 @@ class RegexpAnnotator:
         are brought into a compatible format (timestamps).
         TODO: Will be replaced by global function in temporal library.
         """
-
+        if not REGEX_YEAR_DIGITS_PATTERN.search(string):
+            return []
         date_norms_text = self.extract_dates_in_text_format(string)
         date_norms_num = self.extract_date_in_num_format(string)
         date_norms = self.remove_duplicate_matched(date_norms_text, date_norms_num)
@@ -1083,23 +966,27 @@ class RegexpAnnotator:
             span = item['span']
             disambiguations[span] = item
 
+        if len(disambiguations) < 2:
+            return list(disambiguations.values())
+
+        # an annotation is dropped if it overlaps with a longer (or later, equally long) annotation
+        # -> find the overlapping pairs in a sweep over the spans sorted by start
         start_end = list(disambiguations.keys())
-        if len(start_end) > 1:
-            for i in range(0, len(start_end) - 1):
-                for j in range(i + 1, len(start_end)):
-                    if not self.check_overlap(start_end[i], start_end[j]):
-                        continue
-                    else:
-                        lengthi = start_end[i][1] - start_end[i][0]
-                        lengthj = start_end[j][1] - start_end[j][0]
-                        if lengthj >= lengthi:
-                            if start_end[i] in disambiguations:
-                                disambiguations.pop(start_end[i])
-                        else:
-                            if start_end[j] in disambiguations:
-                                disambiguations.pop(start_end[j])
-
-        return list(disambiguations.values())
+        removed = set()
+        active = []
+        for position in sorted(range(len(start_end)), key=lambda k: start_end[k]):
+            start, end = start_end[position]
+            # spans ending before the start cannot overlap this or any later span
+            active = [k for k in active if start_end[k][1] >= start]
+            length = end - start
+            for k in active:
+                lengthk = start_end[k][1] - start_end[k][0]
+                i, j = (k, position) if k < position else (position, k)
+                lengthi = length if i == position else lengthk
+                lengthj = length if j == position else lengthk
+                removed.add(i if lengthj >= lengthi else j)
+            active.append(position)
+        return [disambiguations[span] for k, span in enumerate(start_end) if k not in removed]
 
     # check whether two results are overlap
     def check_overlap(self, rangei, rangej):
@@ -1116,3 +1003,28 @@ class RegexpAnnotator:
             return True
         elif start1 > start2 and start1 < end2:
             return True
+
+
+def _annotate_chunk(strings):
+    """
+    Annotate the dates in the given strings (in a worker process).
+    Annotations are returned as tuples (text, span, timespan, disambiguation).
+    """
+    annotator = RegexpAnnotator()
+    return [[(annotation["text"], annotation["span"], annotation["timespan"], annotation["disambiguation"])
+             for annotation in annotator.regex_annotation_normalization(string)]
+            for string in strings]
+
+
+DATE_CONVERTERS = {
+    "dmy": RegexpAnnotator._convert_dmy_to_timestamp,
+    "ymd": RegexpAnnotator._convert_ymd_to_timestamp,
+    "mdy": RegexpAnnotator._convert_mdy_to_timestamp,
+    "my": RegexpAnnotator._convert_my_to_timestamp,
+    "timespan1": RegexpAnnotator._convert_timespan1_to_timestamp,
+    "timespan2": RegexpAnnotator._convert_timespan2_to_timestamp,
+    "timespan3": RegexpAnnotator._convert_timespan3_to_timestamp,
+    "timespan4": RegexpAnnotator._convert_timespan4_to_timestamp,
+    "timespan5": RegexpAnnotator._convert_timespan5_to_timestamp,
+    "timespan6": RegexpAnnotator._convert_timespan6_to_timestamp,
+}
@@ -15,8 +15,10 @@ class SpacyTokenizer(Tokenizer):
     def tokenize(self, text):
         # We don't treat new lines as tokens.
         clean_text = text.replace('\n', ' ')
-        tokens = self.nlp(clean_text)
+        return self.tokens_from_doc(text, self.nlp(clean_text))
 
+    def tokens_from_doc(self, text, tokens):
+        # The doc of the given text, processed by the spaCy pipeline already.
         data = []
         for i in range(len(tokens)):
             # Get whitespace
@@ -1,11 +1,23 @@
+import copy
+import hashlib
 import os
+import re
+import threading
 
+import spacy
 from spacy.matcher import Matcher
 from spacy.tokens import Span
 
+from tiq.library.sqlite_store import BoundedSqliteStore
 from tiq.library.temporal_library import TemporalValueAnnotator
+from tiq.library.tracing import get_tracer
 from tiq.library.utils import get_logger
 
+# all date patterns of the regex date annotator contain a year (four digits)
+YEAR_DIGITS_PATTERN = re.compile(r"\d{4}")
+# increase when the annotation changes, such that cached results are not used anymore
+ANNOTATION_CACHE_VERSION = 1
+
 
 class TemporalAnnotator:
     # temporal annotation result
@@ -75,6 +87,7 @@ class TemporalExpression:
     def __init__(self, config):
         self.config = config
         self.logger = get_logger(__name__, config)
+        self.tracer = get_tracer(config)
         self.pattern = dict()
         self.temporal_value_annotator = TemporalValueAnnotator(config)
         self.date_ordinal_annotator = self.temporal_value_annotator.date_ordinal_annotator
@@ -82,7 +95,8 @@ class TemporalExpression:
         self.explicit_signal_type = dict()
         # open explicit signal keywords file
         with open(os.path.join(self.config["data_path"], self.config["path_to_explicit_signals"]), "r") as fp:
-            for line in fp.readlines():
+            signal_lines = fp.readlines()
+            for line in signal_lines:
                 keyword = line.split("||")[0].strip()
                 signal = line.split("||")[1].strip()
                 if signal not in self.explicit_signal_type:
@@ -90,6 +104,36 @@ class TemporalExpression:
                 self.explicit_signal_type[signal].add(keyword)
 
         self.explicit_patterns = self._explicit_pattern()
+        # one matcher for the patterns of all signals
+        self.explicit_matcher = Matcher(self.tokenizer.nlp.vocab)
+        for signal, pattern in self.explicit_patterns.items():
+            self.explicit_matcher.add(signal, pattern)
+        # strings are processed by spaCy in batches
+        self.batch_size = self.config["temporal_annotation_batch_size"]
+        self.n_process = self.config["temporal_annotation_processes"]
+        # number of strings skipped (no year digits, no dates) and annotated with spaCy
+        self.counters = {"skipped_no_year_digits": 0, "skipped_no_dates": 0, "annotated": 0, "cache_hits": 0}
+        self.counter_lock = threading.Lock()
+
+        # annotation results are cached on disk by the hash of the string (shared by processes)
+        self.cache = None
+        if self.config["temporal_annotation_use_cache"]:
+            path_to_cache = os.path.join(self.config["data_path"], self.config["temporal_annotation_cache_file"])
+            self.cache = BoundedSqliteStore(path_to_cache, table="annotations",
+                                            max_size=self.config["temporal_annotation_cache_size"])
+            self.cache_fingerprint = self._cache_fingerprint(signal_lines)
+
+    def _cache_fingerprint(self, signal_lines):
+        """Fingerprint of everything (besides the string) the annotation results depend on."""
+        fingerprint = hashlib.sha1()
+        for part in [str(ANNOTATION_CACHE_VERSION), spacy.__version__, self.config["spacy_model"]] + signal_lines:
+            fingerprint.update(part.encode("utf-8"))
+            fingerprint.update(b"\0")
+        return fingerprint.hexdigest()
+
+    def _cache_key(self, string, reference_time, date_tag_method):
+        key = "\0".join([self.cache_fingerprint, str(reference_time), str(date_tag_method), string])
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
 
     def _explicit_pattern(self):
         pattern = {}
@@ -124,10 +168,7 @@ class TemporalExpression:
                     pattern[signal].append(multiple_word_pattern)
         return pattern
 
-    def exlicit_pattern_match(self, string, doc, signal, pattern, disambiguations):
-        matcher = Matcher(self.tokenizer.nlp.vocab)
-        matcher.add(signal, pattern)
-        matches = matcher(doc)
+    def exlicit_pattern_match(self, string, doc, signal, matches, disambiguations):
         matches.sort(key=lambda x: x[1])
         matched_expressions = []
         if len(matches) > 0:
@@ -211,16 +252,106 @@ class TemporalExpression:
         return list(date_in_matched_pattern.values())
 
     def annotateExplicitTemporalExpressions(self, string, reference_time, date_tag_method):
-        temporal_annotations = self.date_ordinal_annotator(string, reference_time, date_tag_method)
-        date_annotator_result = temporal_annotations[0]
-        ordinal_annotator_result = temporal_annotations[1]
+        return self.annotateExplicitTemporalExpressionsBatch([string], reference_time, date_tag_method)[0]
+
+    def annotateExplicitTemporalExpressionsBatch(self, strings, reference_time, date_tag_method,
+                                                 require_dates=False):
+        """
+        Annotate the given strings (e.g., all sentences of a page).
+        The strings are processed by spaCy in batches, and the doc of a string
+        is used for both, the ordinal annotation and the explicit expressions.
+        With require_dates, strings without dates are not processed by spaCy:
+        they have no explicit expressions (and ordinals are not part of the results).
+        Results of strings annotated before are taken from the cache (if enabled).
+        """
+        self.tracer.count("sentences_annotated", len(strings))
+        with self.tracer.span("temporal_annotation", strings=len(strings)):
+            return self._annotate_batch(strings, reference_time, date_tag_method, require_dates)
+
+    def _annotate_batch(self, strings, reference_time, date_tag_method, require_dates):
+        date_annotator_results = self.temporal_value_annotator.date_annotator_batch(strings, reference_time,
+                                                                                    date_tag_method)
+        annotate = list()
+        counters = {"skipped_no_year_digits": 0, "skipped_no_dates": 0, "cache_hits": 0}
+        for string, date_annotator_result in zip(strings, date_annotator_results):
+            if require_dates and not YEAR_DIGITS_PATTERN.search(string):
+                annotate.append(False)
+                counters["skipped_no_year_digits"] += 1
+                continue
+            annotate.append(bool(date_annotator_result) or not require_dates)
+            if not annotate[-1]:
+                counters["skipped_no_dates"] += 1
+
+        strings_to_annotate = [string for string, flag in zip(strings, annotate) if flag]
+        # results of strings annotated before are taken from the cache
+        cache_keys = dict()
+        cached = dict()
+        if self.cache is not None:
+            cache_keys = {string: self._cache_key(string, reference_time, date_tag_method)
+                          for string in strings_to_annotate}
+            cached = self.cache.get_many(cache_keys.values())
+            strings_to_annotate = [string for string in strings_to_annotate if cache_keys[string] not in cached]
+
+        # starting worker processes only pays off for many strings
+        n_process = self.n_process if len(strings_to_annotate) > self.batch_size else 1
+        docs = iter(self.tokenizer.nlp.pipe(strings_to_annotate, batch_size=self.batch_size, n_process=n_process))
+        results = list()
+        new_results = dict()
+        used_keys = set()
+        for string, date_annotator_result, flag in zip(strings, date_annotator_results, annotate):
+            if not flag:
+                results.append(([], [], [], []))
+                continue
+            key = cache_keys.get(string)
+            if key in cached:
+                # results are not shared between multiple occurrences of a string
+                result = cached[key] if key not in used_keys else copy.deepcopy(cached[key])
+                used_keys.add(key)
+                counters["cache_hits"] += 1
+            else:
+                result = self._annotate_doc(string, next(docs), date_annotator_result)
+                if key is not None:
+                    new_results[key] = result
+            results.append(result)
+        if self.cache is not None:
+            self.cache.put_many(new_results.items())
+        counters["annotated"] = len(strings_to_annotate)
+        self._count(counters)
+        return results
+
+    def store_cache(self):
+        """Write the pending accesses of cached results (used for evicting the least recently used)."""
+        if self.cache is not None:
+            self.cache.flush()
+
+    def shutdown(self):
+        """Stop the worker processes of the annotation."""
+        self.temporal_value_annotator.shutdown()
+
+    def statistics(self):
+        """Return a copy of the counters of skipped and annotated strings."""
+        with self.counter_lock:
+            return dict(self.counters)
+
+    def _count(self, counters):
+        with self.counter_lock:
+            for name, value in counters.items():
+                self.counters[name] += value
+        for name, value in counters.items():
+            self.tracer.count(f"temporal_annotation_{name}", value)
+
+    def _annotate_doc(self, string, doc, date_annotator_result):
+        # ordinals are annotated before the dates are set as entities of the doc
+        # (the ordinal annotation does not treat new lines as tokens)
+        ordinal_doc = doc if "\n" not in string else None
+        ordinal_annotator_result = self.temporal_value_annotator.ordinal_annotator(string, date_annotator_result,
+                                                                                   ordinal_doc)
         disambiguations = {}
         for item in date_annotator_result:
             text = item['text']
             timespan = item['timespan']
             disambiguations.update({item['span']: [text, timespan]})
         spans = []
-        doc = self.tokenizer.nlp(string)
         # list of spans for date as entity
         for item in list(disambiguations.keys()):
             # add the tag "TEMP" as a new entity label for spacy
@@ -230,10 +361,13 @@ class TemporalExpression:
             # annotate date as entities in text
         doc.set_ents(entities=spans)
 
+        matches = {signal: [] for signal in self.explicit_patterns}
+        for match in self.explicit_matcher(doc):
+            matches[self.tokenizer.nlp.vocab.strings[match[0]]].append(match)
+
         explicit_signal_expression = {}
-        for signal, pattern in self.explicit_patterns.items():
-            # print (pattern)
-            explicit_signal_expression[signal] = self.exlicit_pattern_match(string, doc, signal, pattern,
+        for signal in self.explicit_patterns:
+            explicit_signal_expression[signal] = self.exlicit_pattern_match(string, doc, signal, matches[signal],
                                                                             disambiguations)
 
         # remove duplicated explicit expressions
@@ -1,3 +1,5 @@
+import os
+
 from tiq.library.temporal_annotator.date_annotator import RegexpAnnotator
 from tiq.library.temporal_annotator.ordinal_annotator import ordinal_annotation
 from tiq.library.temporal_annotator.spacy_tokenizer import SpacyTokenizer
@@ -7,10 +9,24 @@ from tiq.library.utils import get_logger
 class TemporalValueAnnotator:
     def __init__(self, config):
         self.logger = get_logger(__name__, config)
-        self.regex = RegexpAnnotator()
+        self.regex = RegexpAnnotator(self._date_annotation_processes(config), config["date_annotation_chunk_size"])
         self.reference_time = config["reference_time"]
         self.tokenizer = SpacyTokenizer(config)
 
+    @staticmethod
+    def _date_annotation_processes(config):
+        """
+        Number of processes for the date annotation. By default (0), the cores are
+        shared by the processes for the year ranges (each has its own annotator).
+        """
+        if config["date_annotation_processes"]:
+            return config["date_annotation_processes"]
+        return max(1, (os.cpu_count() or 1) // max(1, config["year_range_processes"]))
+
+    def shutdown(self):
+        """Stop the worker processes of the date annotation."""
+        self.regex.shutdown()
+
     def date_ordinal_annotator(self, string, reference_time=None, date_tag_method="regex"):
         if not reference_time:
             reference_time = self.reference_time
@@ -22,6 +38,10 @@ class TemporalValueAnnotator:
         annotation_dates = self.regex.regex_annotation_normalization_multithreading(string_refers)
         return annotation_dates
 
+    def date_annotator_batch(self, strings, reference_time=None, tag_method="regex"):
+        """Annotate the dates in the given list of strings (see date_annotator)."""
+        return self.regex.regex_annotation_normalization_batch(strings)
+
     def date_annotator(self, string, reference_time=None, tag_method="regex"):
         """
         Can be used for annotating dates in questions and evidences.
@@ -39,19 +59,23 @@ class TemporalValueAnnotator:
 
         return self.regex.regex_annotation_normalization(string)
 
-    def ordinal_annotator(self, string, date_annotator_result):
+    def ordinal_annotator(self, string, date_annotator_result, doc=None):
         """
         Can be used for annotating ordinals in questions and evidences.
         annotate ordinal.
         :param string: a question or a sentence from evidences
         :param date_annotator_result:
+        :param doc: spaCy doc of the string (if already processed)
         :return: ordinal annotation result: a list of dictionary including
                 {'text': ordinal text,
                 'span': text span,
                 'ordinal': ordinal normalization number
                 }
         """
-        tokenized_string = self.tokenizer.tokenize(string)
+        if doc is None:
+            tokenized_string = self.tokenizer.tokenize(string)
+        else:
+            tokenized_string = self.tokenizer.tokens_from_doc(string, doc)
         ordinal_result = ordinal_annotation(tokenized_string)
         ordinal_annotator_result = self.remove_ordinal_in_date(ordinal_result, date_annotator_result)
         return ordinal_annotator_result
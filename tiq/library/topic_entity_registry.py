@@ -0,0 +1,137 @@
+"""
+Registry of the topic entities sampled so far, shared by the processes
+which generate pseudo-questions for different year ranges.
+
+Entities are appended to a text file (one entity per line) under a file lock.
+The registry is used in place of the list of topic entities:
+entities are added with +=, and iterating yields the entities added by all processes.
+Sampled entities are claimed (checked and added in one step under the lock), such that
+no two processes sample the same entity, and claimed entities can be released again.
+The entities are kept in memory, only lines appended since the last read are read
+(membership tests in the sampling loop only check the size of the file).
+"""
+import os
+
+from filelock import FileLock
+
+
+class TopicEntityRegistry:
+    def __init__(self, path, entities=None):
+        """
+        :param path: path of the registry file
+        :param entities: if given, the registry is (re-)initialized with these entities
+        """
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        # entities read so far, and (inode, offset) of the file up to which they were read
+        self.cached_entities = list()
+        self.cached_entity_set = set()
+        self.read_position = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if entities is not None:
+            with FileLock(self.lock_path):
+                # replaced (new inode), such that registries reading the file notice the re-initialization
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w") as fp:
+                    for entity in entities:
+                        fp.write(f"{entity}\n")
+                os.replace(tmp_path, self.path)
+
+    def __iadd__(self, entities):
+        self.extend(entities)
+        return self
+
+    def extend(self, entities):
+        self.claim(entities)
+
+    def claim(self, entities):
+        """
+        Add the entities not registered yet (by any process), and return them.
+        Checking and adding is atomic, an entity is claimed by one process only.
+        """
+        with FileLock(self.lock_path):
+            self._read_appended()
+            claimed = list()
+            for entity in entities:
+                if entity not in self.cached_entity_set:
+                    claimed.append(entity)
+                    self.cached_entity_set.add(entity)
+            if claimed:
+                with open(self.path, "a") as fp:
+                    fp.write("".join(f"{entity}\n" for entity in claimed))
+            self._read_appended()
+        return claimed
+
+    def release(self, entities):
+        """Remove the given (claimed) entities, such that they can be claimed again."""
+        entities = set(entities)
+        with FileLock(self.lock_path):
+            self._read_appended()
+            if not entities & self.cached_entity_set:
+                return
+            # replaced (new inode), such that registries reading the file notice the removal
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as fp:
+                for entity in self.cached_entities:
+                    if entity not in entities:
+                        fp.write(f"{entity}\n")
+            os.replace(tmp_path, self.path)
+            self._read_appended()
+
+    def entities(self):
+        """Return the list of all registered entities (in the order of registration)."""
+        self._refresh()
+        return list(self.cached_entities)
+
+    def _refresh(self):
+        """Read the entities appended (by any process) since the last read."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset_cache()
+            return
+        if self.read_position == (stat.st_ino, stat.st_size):
+            return
+        with FileLock(self.lock_path):
+            self._read_appended()
+
+    def _read_appended(self):
+        """Read the entities appended since the last read (the file lock has to be held)."""
+        try:
+            fp = open(self.path, "rb")
+        except FileNotFoundError:
+            self._reset_cache()
+            return
+        with fp:
+            inode = os.fstat(fp.fileno()).st_ino
+            if self.read_position is None or self.read_position[0] != inode \
+                    or self.read_position[1] > os.fstat(fp.fileno()).st_size:
+                # the registry was re-initialized (or entities were released): read it from the beginning
+                self._reset_cache()
+                offset = 0
+            else:
+                offset = self.read_position[1]
+            fp.seek(offset)
+            data = fp.read()
+        for line in data.decode("utf-8").splitlines():
+            entity = line.strip()
+            if entity:
+                self.cached_entities.append(entity)
+                self.cached_entity_set.add(entity)
+        self.read_position = (inode, offset + len(data))
+
+    def _reset_cache(self):
+        self.cached_entities = list()
+        self.cached_entity_set = set()
+        self.read_position = None
+
+    def __iter__(self):
+        return iter(self.entities())
+
+    def __len__(self):
+        self._refresh()
+        return len(self.cached_entities)
+
+    def __contains__(self, entity):
+        self._refresh()
+        return entity in self.cached_entity_set
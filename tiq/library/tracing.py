@@ -0,0 +1,215 @@
+"""
+Instrumentation of the pipeline with nested spans (timed sections) and counters.
+
+Spans are nested per thread, e.g. stage -> year range -> iteration -> entity -> call
+(HTTP, CLOCQ, temporal annotation, embeddings). Functions running in worker threads
+are nested in the span of the submitting thread via Tracer.bind.
+The tracer of a process writes
+- a JSON trace with the recorded spans and the counters, and
+- a Prometheus textfile with the total seconds and number of spans per span name,
+  and the counters (to be scraped via the textfile collector of the node exporter).
+Child processes write their own files (suffixed by the process id), and all samples
+are labelled with the process id, such that the series of the processes are distinct.
+"""
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+class Tracer:
+    def __init__(self, enabled=True, trace_path=None, metrics_path=None, max_spans=100000):
+        """
+        :param trace_path: path of the JSON trace (not written if None)
+        :param metrics_path: path of the Prometheus textfile (not written if None)
+        :param max_spans: maximum number of spans kept for the trace (all spans are aggregated)
+        """
+        self.enabled = enabled
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self.max_spans = max_spans
+        self.next_id = 0
+        self._reset()
+        if multiprocessing.parent_process() is None:
+            # files of the child processes of earlier runs would be scraped (and read) as current
+            self._remove_process_files()
+        # a forked process records its own spans and counters (and writes its own files)
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # the lock might be held by another thread of the parent at the time of the fork,
+        # and the span stacks of the parent threads are not valid in a forked process
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.spans = list()
+        self.dropped_spans = 0
+        self.span_seconds = defaultdict(float)
+        self.span_counts = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    def _stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = list()
+        return stack
+
+    def current_span(self):
+        """Return the id of the innermost open span of the current thread."""
+        stack = self._stack()
+        return stack[-1] if stack else getattr(self.local, "parent", None)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the enclosed block as span with the given name."""
+        if not self.enabled:
+            yield
+            return
+        parent = self.current_span()
+        with self.lock:
+            span_id = self.next_id
+            self.next_id += 1
+        stack = self._stack()
+        stack.append(span_id)
+        start_time = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                self.span_seconds[name] += seconds
+                self.span_counts[name] += 1
+                if len(self.spans) < self.max_spans:
+                    self.spans.append({"id": span_id, "parent": parent, "name": name, "start": start_time,
+                                       "seconds": seconds, "pid": os.getpid(), "thread": threading.get_ident(),
+                                       "attributes": attributes})
+                else:
+                    self.dropped_spans += 1
+
+    def count(self, name, value=1):
+        """Increase the counter with the given name."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += value
+
+    def bind(self, function):
+        """
+        Return the function such that spans opened while running it
+        (in any thread) are nested in the current span of this thread.
+        """
+        if not self.enabled:
+            return function
+        parent = self.current_span()
+
+        def bound(*args, **kwargs):
+            previous = getattr(self.local, "parent", None)
+            self.local.parent = parent
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.local.parent = previous
+
+        return bound
+
+    def statistics(self):
+        """Return the total seconds and number of spans per span name, and the counters."""
+        with self.lock:
+            return {
+                "spans": {name: {"seconds": self.span_seconds[name], "count": self.span_counts[name]}
+                          for name in self.span_counts},
+                "counters": dict(self.counters),
+            }
+
+    def export(self):
+        """Write the JSON trace and the Prometheus textfile."""
+        if not self.enabled:
+            return
+        with self.lock:
+            trace = {"pid": os.getpid(), "spans": list(self.spans), "dropped_spans": self.dropped_spans,
+                     "counters": dict(self.counters)}
+            metrics = self._prometheus_lines()
+        if self.trace_path:
+            _write_atomically(self._process_path(self.trace_path), json.dumps(trace))
+        if self.metrics_path:
+            _write_atomically(self._process_path(self.metrics_path), "\n".join(metrics) + "\n")
+
+    def _prometheus_lines(self):
+        pid = os.getpid()
+        lines = [
+            "# HELP tiq_span_seconds_total Total time spent in spans with the given name.",
+            "# TYPE tiq_span_seconds_total counter",
+        ]
+        lines += [f'tiq_span_seconds_total{{span="{_escape(name)}",pid="{pid}"}} {seconds}'
+                  for name, seconds in sorted(self.span_seconds.items())]
+        lines += [
+            "# HELP tiq_spans_total Number of spans with the given name.",
+            "# TYPE tiq_spans_total counter",
+        ]
+        lines += [f'tiq_spans_total{{span="{_escape(name)}",pid="{pid}"}} {count}'
+                  for name, count in sorted(self.span_counts.items())]
+        lines += [
+            "# HELP tiq_events_total Pipeline counters (pages fetched, sentences annotated, ...).",
+            "# TYPE tiq_events_total counter",
+        ]
+        lines += [f'tiq_events_total{{counter="{_escape(name)}",pid="{pid}"}} {value}'
+                  for name, value in sorted(self.counters.items())]
+        return lines
+
+    def _process_path(self, path):
+        """Child processes write their own files (the path gets the process id as suffix)."""
+        if multiprocessing.parent_process() is None:
+            return path
+        root, extension = os.path.splitext(path)
+        return f"{root}.{os.getpid()}{extension}"
+
+    def _remove_process_files(self):
+        """Remove the files written by child processes (see _process_path)."""
+        for path in (self.trace_path, self.metrics_path):
+            directory = os.path.dirname(os.path.abspath(path)) if path else None
+            if not directory or not os.path.isdir(directory):
+                continue
+            root, extension = os.path.splitext(os.path.basename(path))
+            pattern = re.compile(rf"{re.escape(root)}\.\d+{re.escape(extension)}")
+            for file_name in os.listdir(directory):
+                if pattern.fullmatch(file_name):
+                    os.remove(os.path.join(directory, file_name))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomically(path, content):
+    Path(os.path.dirname(os.path.abspath(path))).mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as fp:
+        fp.write(content)
+    os.replace(tmp_path, path)
+
+
+def get_tracer(config=None):
+    """
+    Return the tracer shared within the process.
+    The tracer is created on the first call, using the given config (if any).
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            if config:
+                _tracer = Tracer(enabled=config["trace_enabled"],
+                                 trace_path=os.path.join(config["result_path"], config["trace_file"]),
+                                 metrics_path=os.path.join(config["result_path"], config["trace_metrics_file"]),
+                                 max_spans=config["trace_max_spans"])
+            else:
+                _tracer = Tracer()
+        return _tracer
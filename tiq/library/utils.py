@@ -7,10 +7,11 @@ import sys
 from pathlib import Path
 
 import nltk
-import requests
 import yaml
 from tqdm import tqdm
 
+from tiq.library.http_library import get_http_client
+
 
 def split_time_range(start_year, end_year, interval=15):
     ranges = []
@@ -79,8 +80,7 @@ def store_jsonl_with_mkdir(data, output_path, indent=False):
 
 def get_qid(wikipedia_link):
     url = f"https://openrefine-wikidata.toolforge.org/en/api?query={wikipedia_link}"
-    response = requests.get(url)
-    results = response.json()
+    results = get_http_client().get_json(url, endpoint="openrefine_qid")
     if results:
         if "result" in results and results["result"]:
             qid = results["result"][0]['id']
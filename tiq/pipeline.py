@@ -6,16 +6,21 @@ Stage 3: rephrase pseudo-questions: question rephrasing via InstructGPT
 '''
 
 import json
+import multiprocessing
 import os
 import pickle
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from clocq.CLOCQ import CLOCQ
 from clocq.interface.CLOCQInterfaceClient import CLOCQInterfaceClient
 
 from tiq.information_snippet_retrieval.wp_retriever.wikipedia_entity_retriever import WikipediaEntityPageRetriever
+from tiq.library.http_library import get_http_client
+from tiq.library.topic_entity_registry import TopicEntityRegistry
+from tiq.library.tracing import get_tracer
 from tiq.library.utils import get_config, get_logger, get_qid, split_time_range, target_question_for_each_range
 from tiq.pseudo_question_construction.pseudo_question_generation import PseudoQuestionGeneration
 from tiq.question_rephrase.sample_pseudo_question_for_rephrase import PseudoQuestionSampleRephrase
@@ -23,6 +28,9 @@ from tiq.year_page_retrieval.year_page_retriever import YearPageRetrieval
 
 EVENT_PAGE_PREFIX = "Portal:Current_events"
 
+# pipeline of a worker process generating pseudo-questions for year ranges (see _init_year_range_process)
+_process_pipeline = None
+
 
 class Pipeline:
     def __init__(self, config):
@@ -34,6 +42,8 @@ class Pipeline:
         # load config
         self.config = config
         self.logger = get_logger(__name__, config)
+        # tracer for the spans and counters of the stages (created first, such that all components share it)
+        self.tracer = get_tracer(config)
 
         # define months in each year
         self.months = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
@@ -47,6 +57,9 @@ class Pipeline:
         self.data_path = self.config["data_path"]
         self.result_path = self.config["result_path"]
 
+        # shared HTTP client for all requests to Wikipedia and Wikidata services
+        self.http_client = get_http_client(config)
+
         # load wikidata qid and wikipedia url mapping dictionary for generating year/month qid and urls
         with open(os.path.join(self.config["data_path"], self.config["path_to_wikidata_mappings"]), "rb") as fp:
             self.wikidata_mappings = pickle.load(fp)
@@ -106,6 +119,9 @@ class Pipeline:
         # topic entities
         self.topic_entities_file_path = os.path.join(self.output_dir, self.config["topic_entity_in_total_file"])
         self.pseudo_questions_file_path = os.path.join(self.output_dir, self.config["pseudo_questions_in_total_file"])
+        self.topic_entity_registry_path = os.path.join(self.output_dir, self.config["topic_entity_registry_file"])
+        # number of year ranges processed in parallel (in separate processes)
+        self.year_range_processes = self.config["year_range_processes"]
 
         self.topic_entities_in_total = []
         # for avoiding the duplicated topic entities, we store the topic entities and initialize via reading the file.
@@ -137,11 +153,13 @@ class Pipeline:
 
     # stage 1: retrieve all year and month pages for the start and end year range
     def year_page_retrieval(self):
-        retrieval = YearPageRetrieval(self.config, self.year_page_out_dir, self.wp_retriever,
-                                      self.get_year_month_page_link_pool)
-        retrieval.retrieve_page_per_year()
-        self.wp_retriever.store_dump()
-        self.wp_retriever.annotator.store_cache()
+        with self.tracer.span("stage.year_page_retrieval"):
+            retrieval = YearPageRetrieval(self.config, self.year_page_out_dir, self.wp_retriever,
+                                          self.get_year_month_page_link_pool)
+            retrieval.retrieve_page_per_year()
+        self._store_caches()
+        self._log_statistics()
+        self._shutdown_workers()
 
     # stage 2: pipeline for generating pseudo-questions, include:
     # (i) topic entity sampling, (ii) information snippet retrieval and (iii) pseudo-question construction
@@ -149,21 +167,14 @@ class Pipeline:
         start_total = time.time()
         # start pipeline for each year range interval. In each interval, repeat the three sub-steps:
         # (i) topic entity sampling, (ii) information snippet retrieval and (iii) pseudo-question construction
-        for range in self.year_range_list:
-            start = time.time()
-            year_start = range[0]
-            year_end = range[1]
-            self.logger.info(f"Start to generate pseudo-questions for the year range: {range}")
-            target_question_number = self.target_question_number_per_range[range]
-            self.logger.info(f"The target question number for the year range {range} is: {target_question_number}")
-            pseudo_ques_pipeline = PseudoQuestionGeneration(self.config, self.wp_retriever, self.year_page_out_dir,
-                                                            year_start, year_end, self.output_dir,
-                                                            self.topic_entities_in_total, target_question_number)
-            pseudo_ques_pipeline.question_generate_iterative()
-            self.pseudo_question_in_total.update(pseudo_ques_pipeline.pseudo_questions)
-            self.topic_entities_in_total += pseudo_ques_pipeline.topic_entities
-            print("Year start for this year range:", year_start)
-            print("Time consumed for this year range:", time.time() - start)
+        with self.tracer.span("stage.pseudo_question_pipeline"):
+            if self.year_range_processes > 1:
+                self._year_ranges_in_processes()
+            else:
+                for range in self.year_range_list:
+                    pseudo_questions, topic_entities = self._year_range(range, self.topic_entities_in_total)
+                    self.pseudo_question_in_total.update(pseudo_questions)
+                    self.topic_entities_in_total += topic_entities
 
         print("Total time consumed:", time.time() - start_total)
         print("Total number of topic entities:", len(self.pseudo_question_in_total.keys()))
@@ -177,12 +188,75 @@ class Pipeline:
         with open(self.pseudo_questions_file_path, "w") as fout:
             fout.write(json.dumps(self.pseudo_question_in_total, indent=4))
 
+        self._store_caches()
+        self._log_statistics()
+        self._shutdown_workers()
+
+    def _year_range(self, range, topic_entities):
+        """
+        Generate pseudo-questions for the given year range.
+        Returns the pseudo-questions and the (updated) topic entities.
+        """
+        start = time.time()
+        year_start = range[0]
+        year_end = range[1]
+        self.logger.info(f"Start to generate pseudo-questions for the year range: {range}")
+        target_question_number = self.target_question_number_per_range[range]
+        self.logger.info(f"The target question number for the year range {range} is: {target_question_number}")
+        with self.tracer.span("year_range", year_start=year_start, year_end=year_end):
+            pseudo_ques_pipeline = PseudoQuestionGeneration(self.config, self.wp_retriever, self.year_page_out_dir,
+                                                            year_start, year_end, self.output_dir,
+                                                            topic_entities, target_question_number)
+            pseudo_ques_pipeline.question_generate_iterative()
+        print("Year start for this year range:", year_start)
+        print("Time consumed for this year range:", time.time() - start)
+        return pseudo_ques_pipeline.pseudo_questions, pseudo_ques_pipeline.topic_entities
+
+    def _year_ranges_in_processes(self):
+        """
+        Generate pseudo-questions for the year ranges in parallel, in worker processes.
+        The processes are spawned (not forked: this process holds threads, open database
+        connections and loaded models), and each builds its own pipeline from the config.
+        Topic entities are claimed in the topic entity registry when they are sampled, such that
+        no two processes sample the same topic entity, and the caches are shared via their files.
+        The pseudo-questions are merged in the order of the year ranges, as without processes
+        (the topic entities of the year ranges are disjoint).
+        """
+        # write pending cache entries before starting the processes, such that they are loaded by every process
+        self._store_caches()
+        # the processes start their own workers
+        self._shutdown_workers()
+        self.topic_entity_registry = TopicEntityRegistry(self.topic_entity_registry_path,
+                                                         self.topic_entities_in_total)
+        processes = min(self.year_range_processes, len(self.year_range_list))
+        self.logger.info(f"Generating pseudo-questions for {len(self.year_range_list)} year ranges "
+                         f"in {processes} processes.")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_year_range_process, initargs=(self.config,)) as executor:
+            range_pseudo_questions = list(executor.map(_year_range_in_process, self.year_range_list))
+        for pseudo_questions in range_pseudo_questions:
+            self.pseudo_question_in_total.update(pseudo_questions)
+        self.topic_entities_in_total = self.topic_entity_registry.entities()
+
+    def _store_caches(self):
         self.wp_retriever.store_dump()
-        self.wp_retriever.annotator.store_cache()
+        self.wp_retriever.entity_metadata.store_cache()
+        self.wp_retriever.temporal_expression.store_cache()
+
+    def _shutdown_workers(self):
+        """Stop the worker processes of the date annotation."""
+        self.wp_retriever.temporal_expression.shutdown()
+
+    def _log_statistics(self):
+        self.logger.info(f"HTTP requests per endpoint: {self.http_client.statistics()}")
+        self.logger.info(f"Temporal annotation of sentences: {self.wp_retriever.temporal_expression.statistics()}")
+        # write the trace and metrics (of this process) collected so far
+        self.tracer.export()
 
     def question_rephrase(self):
-        rephrase = PseudoQuestionSampleRephrase(config)
-        sample_questions, rephrased_questions, filered_rephrased_questions = rephrase.sample_and_rephrase_pseudo_questions()
+        with self.tracer.span("stage.question_rephrase"):
+            rephrase = PseudoQuestionSampleRephrase(config)
+            sample_questions, rephrased_questions, filered_rephrased_questions = rephrase.sample_and_rephrase_pseudo_questions()
 
         with open(os.path.join(self.output_dir, "sample_questions_in_total.json"), "w") as fp:
             fp.write(json.dumps(sample_questions, indent=4))
@@ -190,6 +264,7 @@ class Pipeline:
             fp.write(json.dumps(rephrased_questions, indent=4))
         with open(os.path.join(self.output_dir, "filtered_rephrased_questions_in_total.json"), "w") as fp:
             fp.write(json.dumps(filered_rephrased_questions, indent=4))
+        self.tracer.export()
 
     def _year_page_pool(self, year_start, year_end):
         ''' generate year qid and url mappings, for example:
@@ -278,6 +353,25 @@ class Pipeline:
         return year_month_pool
 
 
+def _init_year_range_process(config):
+    """Build the pipeline of a worker process (see _year_ranges_in_processes)."""
+    global _process_pipeline
+    _process_pipeline = Pipeline(config)
+    # the registry was initialized by the parent process
+    _process_pipeline.topic_entity_registry = TopicEntityRegistry(_process_pipeline.topic_entity_registry_path)
+
+
+def _year_range_in_process(range):
+    """Generate pseudo-questions for the given year range in a worker process (see _year_ranges_in_processes)."""
+    pipeline = _process_pipeline
+    pseudo_questions, _ = pipeline._year_range(range, pipeline.topic_entity_registry)
+    pipeline._store_caches()
+    pipeline.logger.info(f"Year range {range} done.")
+    pipeline._log_statistics()
+    pipeline._shutdown_workers()
+    return pseudo_questions
+
+
 #######################################################################################################################
 #######################################################################################################################
 if __name__ == "__main__":
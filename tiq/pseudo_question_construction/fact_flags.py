@@ -0,0 +1,60 @@
+# keyword flags of main and constraint parts, used for dropping pairs with the same fact
+# (e.g., "... died ..." and "... date of death ...").
+# The flags are computed once per part and stored as one integer.
+
+DEATH_WORD = 1  # "die", "death" or "dead"
+BIRTH_WORD = 2  # "bear" or "birth"
+BIRTHDATE_WORD = 4  # "birthdate"
+SPOUSE_WORD = 8  # "spouse"
+DEATH_DATE_TEXT = 16  # "date of death" or "death date"
+BIRTH_DATE_TEXT = 32  # "date of birth"
+
+LEMMA_FLAGS = {
+    "die": DEATH_WORD,
+    "death": DEATH_WORD,
+    "dead": DEATH_WORD,
+    "bear": BIRTH_WORD,
+    "birth": BIRTH_WORD,
+    "birthdate": BIRTHDATE_WORD,
+    "spouse": SPOUSE_WORD,
+}
+
+
+def fact_flags(lemmas, text):
+    """Flags of a part, given the lemmas of its lowercased text."""
+    flags = 0
+    for lemma in lemmas:
+        flags |= LEMMA_FLAGS.get(lemma, 0)
+    text = text.lower()
+    if "date of death" in text or "death date" in text:
+        flags |= DEATH_DATE_TEXT
+    if "date of birth" in text:
+        flags |= BIRTH_DATE_TEXT
+    return flags
+
+
+def fact_flags_batch(nlp, texts, batch_size=256):
+    """Flags of all given texts, lemmatized with the spaCy pipeline in batches."""
+    lowercased = [text.lower().replace("\n", " ") for text in texts]
+    return [fact_flags([token.lemma_ for token in doc], text)
+            for doc, text in zip(nlp.pipe(lowercased, batch_size=batch_size), texts)]
+
+
+def have_same_fact_keywords(flags1, flags2):
+    """
+    Whether one part mentions a death (birth) and the other one the date of death (birth).
+    """
+    if flags1 & DEATH_WORD and flags2 & DEATH_DATE_TEXT:
+        return True
+    if flags2 & DEATH_WORD and flags1 & DEATH_DATE_TEXT:
+        return True
+    if flags1 & BIRTH_WORD and flags2 & (BIRTHDATE_WORD | BIRTH_DATE_TEXT):
+        return True
+    if flags2 & BIRTH_WORD and flags1 & (BIRTHDATE_WORD | BIRTH_DATE_TEXT):
+        return True
+    return False
+
+
+def have_same_event_keywords(flags1, flags2):
+    """Whether both parts mention a birth, a death or a spouse."""
+    return bool(flags1 & flags2 & (BIRTH_WORD | DEATH_WORD | SPOUSE_WORD))
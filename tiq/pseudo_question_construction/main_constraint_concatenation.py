@@ -4,12 +4,21 @@
 import json
 import re
 import time
+from bisect import bisect_left, bisect_right
 
 from tiq.library.temporal_annotator.spacy_tokenizer import SpacyTokenizer
+from tiq.library.tracing import get_tracer
 from tiq.library.utils import get_logger, format_text
+from tiq.pseudo_question_construction.fact_flags import fact_flags, have_same_fact_keywords, \
+    have_same_event_keywords
 
 KB_ITEM_SEPARATOR = ", "
 relation_word_map = {"BEFORE": "before", "AFTER": "after", "OVERLAP": "during"}
+# Any signal (before, after, overlap) requires the timespans of main and constraint to be close:
+# the start of the constraint is at most ~1 year (plus the few days allowed for before/after)
+# after the end of the main part, and the end of the constraint at most ~1 year before its start.
+# The margin is conservative, the exact check is done by reason_signal.
+SIGNAL_TIME_MARGIN = 20000
 
 
 def remove_multispace(text):
@@ -29,6 +38,7 @@ class MainConstraintConcatenate:
         # load or generate frequency for each qid
         self.config = config
         self.logger = get_logger(__name__, config)
+        self.tracer = get_tracer(config)
         self.tokenizer = SpacyTokenizer(config)
         self.max_pseudo_question_length = self.config["max_pseudo_question_length"]
 
@@ -170,29 +180,10 @@ class MainConstraintConcatenate:
             if connectivity > 0:
                 connect_pair[(pair[0], pair[1])] = float(connectivity)
 
-    def check_have_same_fact(self, part1, part2, main_timespan, constraint_timespan, main_entity, constraint_entity):
+    def check_have_same_fact(self, part1_flags, part2_flags, main_timespan, constraint_timespan, main_entity,
+                             constraint_entity):
         # check according to surface words
-        part1_words = self.tokenizer.tokenize(part1.lower()).lemmas()
-        part2_words = self.tokenizer.tokenize(part2.lower()).lemmas()
-        if (
-                "die" in part1_words or "death" in part1_words or "dead" in part1_words) and "date of death" in part2.lower():
-            return True
-        elif (
-                "die" in part2_words or "death" in part2_words or "dead" in part2_words) and "date of death" in part1.lower():
-            return True
-        elif (
-                "die" in part1_words or "death" in part1_words or "dead" in part1_words) and "death date" in part2.lower():
-            return True
-        elif (
-                "die" in part2_words or "death" in part2_words or "dead" in part2_words) and "death date" in part1.lower():
-            return True
-        elif ("bear" in part1_words or "birth" in part1_words) and "birthdate" in part2_words:
-            return True
-        elif ("bear" in part2_words or "birth" in part2_words) and "birthdate" in part1_words:
-            return True
-        elif ("bear" in part1_words or "birth" in part1_words) and "date of birth" in part2.lower():
-            return True
-        elif ("bear" in part2_words or "birth" in part2_words) and "date of birth" in part1.lower():
+        if have_same_fact_keywords(part1_flags, part2_flags):
             return True
 
         # check according to same entity and same date
@@ -200,12 +191,7 @@ class MainConstraintConcatenate:
                 main_timespan[1] - constraint_timespan[1]) < 2:
             # "Death of Abu Bakr al-Baghdadi, Statement from the President on the Death of Abu Bakr al-Baghdadi, October 27, 2019.",
             # "Death of Abu Bakr al-Baghdadi, point in time, 26 October \"2019"
-            if ("bear" in part1_words or "birth" in part1_words) and ("bear" in part2_words or "birth" in part2_words):
-                return True
-            elif ("die" in part1_words or "death" in part1_words or "dead" in part1_words) and (
-                    "die" in part2_words or "death" in part2_words or "dead" in part2_words):
-                return True
-            elif "spouse" in part1_words and "spouse" in part2_words:
+            if have_same_event_keywords(part1_flags, part2_flags):
                 return True
             else:
                 main_entities = set([item["id"] for item in main_entity if item["id"][0] == "Q"])
@@ -213,6 +199,13 @@ class MainConstraintConcatenate:
                 if main_entities == constraint_entities:
                     return True
 
+    def _part_fact_flags(self, part, text_key):
+        """Keyword flags of the part (computed in main/constraint generation, or here for older parts)."""
+        if "fact_flags" not in part:
+            text = part[text_key]
+            part["fact_flags"] = fact_flags(self.tokenizer.tokenize(text.lower()).lemmas(), text)
+        return part["fact_flags"]
+
     def concatenate_main_constraint_semantic_base(self, main_part_file, constraint_part_file):
         # concatenate two part
         with open(main_part_file, "r") as fin:
@@ -222,7 +215,9 @@ class MainConstraintConcatenate:
             constraint_parts = json.load(fin)
 
         start = time.time()
+        constraint_instances, constraint_index = self._index_constraints(constraint_parts)
         pseudo_question_per_entity = {}
+        pairs_evaluated = 0
         for retrieved_for_entity, main_instances in main_questions.items():
             # for each constraint, we randomly select main questions
             pseudo_question_per_entity[retrieved_for_entity] = []
@@ -233,63 +228,66 @@ class MainConstraintConcatenate:
                 main_question_text = main_instance["main_question_text"]
                 main_pseudo_question = main_instance["main_pseudo_question"]
                 main_timespan = [main_instance["start_time_int"], main_instance["end_time_int"]]
-                for key, constraint_instances in constraint_parts.items():
-                    for constraint_instance in constraint_instances:
-
-                        if len(main_question_text.split()) + len(
-                                constraint_instance["constraint_text"].split()) > self.max_pseudo_question_length:
-                            continue
-
-                        constraint_timespan = [constraint_instance["start_time_int"],
-                                               constraint_instance["end_time_int"]]
-                        # drop main questions having the same fact with constraint
-                        if main_instance["evidence_id"] == constraint_instance["evidence_id"]: continue
-                        # drop main questions having die born and constraint having date of death, date of birth and vice versa
-                        # drop the constraint parts that contain the entities in answers
-                        if set([item["id"] for item in main_instance["answer_entity"]]).intersection(
-                                set([item["id"] for item in constraint_instance["wikidata_entities"]])):
-                            continue
-
-
-                        semantic_type = 0.0
-                        if set([item["id"] for item in constraint_instance["wikidata_entities"]]).intersection(
-                                set([item["id"] for item in main_instance["question_entity"]])):
-                            semantic_type = 2.0
-
-                        if semantic_type != 2.0:
-                            continue
-
-                        if self.check_have_same_fact(main_instance["main_question_text"],
-                                                     constraint_instance["constraint_text"], main_timespan,
-                                                     constraint_timespan,
-                                                     main_instance["question_entity"],
-                                                     constraint_instance["wikidata_entities"]):
-                            continue
-
-                        signal = self.reason_signal(main_timespan, constraint_timespan)
-                        # we take care of before after in another function
-                        if not signal: continue
-
-                        generate_question = {}
-                        pseudo_question = f'{main_pseudo_question}, {relation_word_map[signal]}, {constraint_instance["constraint_text"]}'
-                        pseudo_question = remove_multispace(pseudo_question)
-                        generate_question["pseudo_question_construction"] = format_text(pseudo_question).encode(
-                            'utf-8').decode('utf-8')
-                        generate_question["semantic_type"] = semantic_type
-                        generate_question["signal"] = signal
-
-                        generate_question["evidence"] = [main_instance["evidence"], constraint_instance["evidence"]]
-                        generate_question["source"] = [main_instance["source"], constraint_instance["source"]]
-                        generate_question["timespan"] = [main_timespan, constraint_timespan]
-                        generate_question["topic_entity"] = main_instance["topic_entity"]
-                        generate_question["question_entity"] = [main_instance["question_entity"],
-                                                                constraint_instance["wikidata_entities"]]
-                        generate_question["answer"] = main_instance["answer_entity"]
-                        generate_question["main_evidence_id"] = main_instance["evidence_id"]
-                        generate_question["constraint_evidence_id"] = constraint_instance["evidence_id"]
-                        generate_question["similar_main_ids"] = main_instance["similar_main_ids"]
-                        if generate_question not in pseudo_questions:
-                            pseudo_questions.append(generate_question)
+                # only constraints sharing a question entity and close in time are candidates
+                candidates = self._candidate_constraints(constraint_index, main_instance)
+                pairs_evaluated += len(candidates)
+                for position in candidates:
+                    constraint_instance = constraint_instances[position]
+
+                    if len(main_question_text.split()) + len(
+                            constraint_instance["constraint_text"].split()) > self.max_pseudo_question_length:
+                        continue
+
+                    constraint_timespan = [constraint_instance["start_time_int"],
+                                           constraint_instance["end_time_int"]]
+                    # drop main questions having the same fact with constraint
+                    if main_instance["evidence_id"] == constraint_instance["evidence_id"]: continue
+                    # drop main questions having die born and constraint having date of death, date of birth and vice versa
+                    # drop the constraint parts that contain the entities in answers
+                    if set([item["id"] for item in main_instance["answer_entity"]]).intersection(
+                            set([item["id"] for item in constraint_instance["wikidata_entities"]])):
+                        continue
+
+
+                    semantic_type = 0.0
+                    if set([item["id"] for item in constraint_instance["wikidata_entities"]]).intersection(
+                            set([item["id"] for item in main_instance["question_entity"]])):
+                        semantic_type = 2.0
+
+                    if semantic_type != 2.0:
+                        continue
+
+                    if self.check_have_same_fact(self._part_fact_flags(main_instance, "main_question_text"),
+                                                 self._part_fact_flags(constraint_instance, "constraint_text"),
+                                                 main_timespan, constraint_timespan,
+                                                 main_instance["question_entity"],
+                                                 constraint_instance["wikidata_entities"]):
+                        continue
+
+                    signal = self.reason_signal(main_timespan, constraint_timespan)
+                    # we take care of before after in another function
+                    if not signal: continue
+
+                    generate_question = {}
+                    pseudo_question = f'{main_pseudo_question}, {relation_word_map[signal]}, {constraint_instance["constraint_text"]}'
+                    pseudo_question = remove_multispace(pseudo_question)
+                    generate_question["pseudo_question_construction"] = format_text(pseudo_question).encode(
+                        'utf-8').decode('utf-8')
+                    generate_question["semantic_type"] = semantic_type
+                    generate_question["signal"] = signal
+
+                    generate_question["evidence"] = [main_instance["evidence"], constraint_instance["evidence"]]
+                    generate_question["source"] = [main_instance["source"], constraint_instance["source"]]
+                    generate_question["timespan"] = [main_timespan, constraint_timespan]
+                    generate_question["topic_entity"] = main_instance["topic_entity"]
+                    generate_question["question_entity"] = [main_instance["question_entity"],
+                                                            constraint_instance["wikidata_entities"]]
+                    generate_question["answer"] = main_instance["answer_entity"]
+                    generate_question["main_evidence_id"] = main_instance["evidence_id"]
+                    generate_question["constraint_evidence_id"] = constraint_instance["evidence_id"]
+                    generate_question["similar_main_ids"] = main_instance["similar_main_ids"]
+                    if generate_question not in pseudo_questions:
+                        pseudo_questions.append(generate_question)
 
             pseudo_question_per_entity[retrieved_for_entity] += pseudo_questions
             if len(pseudo_question_per_entity[retrieved_for_entity]) == 0:
@@ -297,10 +295,73 @@ class MainConstraintConcatenate:
             self.logger.debug(f"Signal reasoning finish for one entity: {retrieved_for_entity}")
 
         self.logger.info(f"Time taken (signal reasoning): {time.time() - start} seconds")
+        self.tracer.count("constraint_pairs_evaluated", pairs_evaluated)
         self.find_similar_main_with_same_constraint(pseudo_question_per_entity)
 
         return pseudo_question_per_entity
 
+    def _index_constraints(self, constraint_parts):
+        """
+        Index the constraint parts by the entities they mention.
+        For each entity, the constraints are sorted by their start time, such that
+        the constraints close in time to a main part can be found via binary search.
+        Returns the list of constraints (in their original order) and the index:
+        entity id -> (start times, end times, positions, maximum duration, positions of constraints without valid timespan)
+        """
+        constraint_instances = [constraint_instance for instances in constraint_parts.values()
+                                for constraint_instance in instances]
+        buckets = dict()
+        for position, constraint_instance in enumerate(constraint_instances):
+            for entity_id in set([item["id"] for item in constraint_instance["wikidata_entities"]]):
+                buckets.setdefault(entity_id, []).append(position)
+
+        constraint_index = dict()
+        for entity_id, positions in buckets.items():
+            timed = list()
+            untimed = list()
+            for position in positions:
+                start_time = constraint_instances[position]["start_time_int"]
+                end_time = constraint_instances[position]["end_time_int"]
+                if self._is_valid_timespan(start_time, end_time):
+                    timed.append((start_time, end_time, position))
+                else:
+                    untimed.append(position)
+            timed.sort()
+            max_duration = max([end_time - start_time for start_time, end_time, _ in timed], default=0)
+            constraint_index[entity_id] = ([item[0] for item in timed], [item[1] for item in timed],
+                                           [item[2] for item in timed], max_duration, untimed)
+        return constraint_instances, constraint_index
+
+    def _candidate_constraints(self, constraint_index, main_instance):
+        """
+        Positions of constraints sharing a question entity with the main part,
+        whose timespan is close enough to the one of the main part for a signal.
+        Positions are returned in the original order of the constraints.
+        """
+        evi_begin = main_instance["start_time_int"]
+        evi_end = main_instance["end_time_int"]
+        timed_main = self._is_valid_timespan(evi_begin, evi_end)
+        candidates = set()
+        for entity_id in set([item["id"] for item in main_instance["question_entity"]]):
+            if entity_id not in constraint_index:
+                continue
+            start_times, end_times, positions, max_duration, untimed = constraint_index[entity_id]
+            candidates.update(untimed)
+            if not timed_main:
+                candidates.update(positions)
+                continue
+            # constraint_start <= evi_end + margin and constraint_end >= evi_begin - margin
+            lowest_end = evi_begin - SIGNAL_TIME_MARGIN
+            left = bisect_left(start_times, lowest_end - max_duration)
+            right = bisect_right(start_times, evi_end + SIGNAL_TIME_MARGIN)
+            for i in range(left, right):
+                if end_times[i] >= lowest_end:
+                    candidates.add(positions[i])
+        return sorted(candidates)
+
+    def _is_valid_timespan(self, start_time, end_time):
+        return isinstance(start_time, int) and isinstance(end_time, int) and 0 < start_time <= end_time
+
     def find_similar_main_with_same_constraint(self, pseudo_question_per_entity):
         for entity, pseudo_questions in pseudo_question_per_entity.items():
             for i in range(len(pseudo_questions) - 1):
@@ -5,12 +5,16 @@ import json
 import string
 
 import nltk
+import torch
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 from sentence_transformers import SentenceTransformer, util
 from tqdm import tqdm
 
+from tiq.library.embedding_cache import EmbeddingCache
+from tiq.library.temporal_annotator.spacy_tokenizer import SpacyTokenizer
 from tiq.library.utils import get_logger
+from tiq.pseudo_question_construction.fact_flags import fact_flags_batch
 
 nltk.download('punkt')  # Download the punkt tokenizer if not already downloaded
 nltk.download('stopwords')  # Download the stopwords if not already downloaded
@@ -50,9 +54,15 @@ class MainConstraintGeneration:
 
         self.clocq = clocq
         # Load a pre-trained model
-        self.model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
+        self.model_name = 'paraphrase-MiniLM-L6-v2'
+        self.model = SentenceTransformer(self.model_name)
+        # embeddings of main pseudo-questions recur across iterations and year ranges
+        self.embedding_cache = EmbeddingCache(config, self.model, self.model_name)
+        # lemmatizer for the keyword flags of main and constraint parts
+        self.tokenizer = SpacyTokenizer(config)
         self.similar_threshold = self.config["similar_threshold"]
         self.text_similar_threshold = self.config["text_similar_threshold"]
+        self.encode_batch_size = self.config["encode_batch_size"]
         self.max_date = int(self.config["MAX_DATE"].replace("-", ""))
         self.min_date = int(self.config["MIN_DATE"].replace("-", ""))
         self.entity_type_map = {}
@@ -98,39 +108,30 @@ class MainConstraintGeneration:
     def _group_similar_main_questions(self, main_parts):
         similar_main_questions = {}
 
-        for entity, mains in main_parts.items():
-            for evidence in mains:
-                evidence["embedding"] = self.model.encode(evidence["main_pseudo_question"], convert_to_tensor=True)
+        # encode the main pseudo-questions of all entities at once
+        main_questions = [evidence["main_pseudo_question"] for mains in main_parts.values() for evidence in mains]
+        if main_questions:
+            embeddings = torch.from_numpy(self.embedding_cache.encode(main_questions, batch_size=self.encode_batch_size))
+            self.logger.info(f"Embedding cache statistics: {self.embedding_cache.statistics()}")
 
+        offset = 0
         for entity, mains in main_parts.items():
-            for evidence in mains:
-                evidence["similar_main_ids"] = []
-                answer_id = evidence["answer_entity"][0]["id"]
-                timespan1 = [evidence["start_time_int"], evidence["end_time_int"]]
-                evidences_for_compare = [item for item in mains if item["evidence_id"] != evidence["evidence_id"]]
-                for item in evidences_for_compare:
-                    timespan2 = [item["start_time_int"], item["end_time_int"]]
-                    if timespan1 != timespan2:
-                        cosine_similarity = util.pytorch_cos_sim(evidence["embedding"], item["embedding"])
-                        similarity_float = cosine_similarity.item()
-                        similarity_float = f"{similarity_float:.3f}"
-                        # when compute the similarity between evidence from text and others, the similarity threshold is relaxed.
-                        if evidence["source"] == "text" or item["source"] == "text":
-                            if cosine_similarity > self.text_similar_threshold:
-                                evidence["similar_main_ids"].append([item["evidence_id"], similarity_float])
-                        elif cosine_similarity > self.similar_threshold:
-                            evidence["similar_main_ids"].append([item["evidence_id"], similarity_float])
+            if not mains:
+                continue
+            entity_embeddings = embeddings[offset:offset + len(mains)]
+            offset += len(mains)
+            similar, similarities = self._similarity_matrix(mains, entity_embeddings)
+            similar = similar.tolist()
+            similarities = similarities.tolist()
+            for i, evidence in enumerate(mains):
+                evidence["similar_main_ids"] = [[item["evidence_id"], f"{similarities[i][j]:.3f}"]
+                                                for j, item in enumerate(mains) if similar[i][j]]
 
                 if len(evidence["similar_main_ids"]) > 0:
                     if entity not in similar_main_questions:
                         similar_main_questions[entity] = []
                     similar_main_questions[entity].append(evidence)
 
-        for entity, mains in main_parts.items():
-            for evidence in mains:
-                if "embedding" in evidence:
-                    del evidence["embedding"]
-
         self.logger.info(
             f"The total number of topic entities with temporal sequence information: {len(similar_main_questions)}")
 
@@ -139,6 +140,31 @@ class MainConstraintGeneration:
 
         return main_parts, similar_main_questions
 
+    def _similarity_matrix(self, mains, embeddings):
+        """
+        Compute the pairwise similarities of the main parts of an entity.
+        Two main parts are similar if they stem from different evidences, have
+        different timespans, and their similarity exceeds the threshold.
+        When compute the similarity between evidence from text and others,
+        the similarity threshold is relaxed.
+        Returns the boolean matrix of similar pairs and the similarity matrix.
+        """
+        similarities = util.cos_sim(embeddings, embeddings).cpu()
+        evidence_ids = {}
+        evidence_index = torch.tensor([evidence_ids.setdefault(evidence["evidence_id"], len(evidence_ids))
+                                       for evidence in mains])
+        start_times = torch.tensor([evidence["start_time_int"] for evidence in mains], dtype=torch.int64)
+        end_times = torch.tensor([evidence["end_time_int"] for evidence in mains], dtype=torch.int64)
+        is_text = torch.tensor([evidence["source"] == "text" for evidence in mains])
+
+        different_evidence = evidence_index.unsqueeze(1) != evidence_index.unsqueeze(0)
+        different_timespan = (start_times.unsqueeze(1) != start_times.unsqueeze(0)) | (
+                end_times.unsqueeze(1) != end_times.unsqueeze(0))
+        thresholds = torch.where(is_text.unsqueeze(1) | is_text.unsqueeze(0),
+                                 torch.tensor(self.text_similar_threshold), torch.tensor(self.similar_threshold))
+        similar = different_evidence & different_timespan & (similarities > thresholds)
+        return similar, similarities
+
     def _contain_meaningless_relation(self, evidence):
         evidence_text = evidence["evidence_text"]
         if "USD" in evidence_text:
@@ -342,6 +368,7 @@ class MainConstraintGeneration:
             if main_part not in question_template_for_entity[retrieved_for_entity]:
                 question_template_for_entity[retrieved_for_entity].append(main_part)
 
+        self._add_fact_flags(question_template_for_entity, "main_question_text")
         return question_template_for_entity
 
     def _convert_constraint_from_text(self, evidences):
@@ -419,4 +446,15 @@ class MainConstraintGeneration:
                     elif int(evidence["index"]) <= 10:
                         constraint_template_for_entity[retrieved_for_entity].append(constraint)
 
+        self._add_fact_flags(constraint_template_for_entity, "constraint_text")
         return constraint_template_for_entity
+
+    def _add_fact_flags(self, parts_for_entity, text_key):
+        """
+        Lemmatize the texts of all parts in one batch, and store the keyword flags
+        used for dropping main and constraint pairs with the same fact.
+        """
+        parts = [part for parts in parts_for_entity.values() for part in parts]
+        flags = fact_flags_batch(self.tokenizer.nlp, [part[text_key] for part in parts])
+        for part, part_flags in zip(parts, flags):
+            part["fact_flags"] = part_flags
@@ -1,5 +1,6 @@
 import json
 import os
+import pickle
 import random
 import re
 import signal
@@ -7,6 +8,9 @@ import time
 from pathlib import Path
 
 from tiq.information_snippet_retrieval.information_snippet_retriever import InformationRetriever
+from tiq.library.http_library import fetch_concurrently
+from tiq.library.stage_runner import StageRunner
+from tiq.library.tracing import get_tracer
 from tiq.library.utils import get_logger
 from tiq.pseudo_question_construction.main_constraint_concatenation import MainConstraintConcatenate
 from tiq.pseudo_question_construction.main_constraint_generation import MainConstraintGeneration
@@ -31,6 +35,7 @@ class PseudoQuestionGeneration:
         # load config
         self.config = config
         self.logger = get_logger(__name__, config)
+        self.tracer = get_tracer(config)
 
         self.data_path = self.config["data_path"]
         self.target_question_number = target_question_number
@@ -58,6 +63,7 @@ class PseudoQuestionGeneration:
 
         # create information snippet retrieval instance
         self.entity_retriever = InformationRetriever(config, self.wp_retriever, self.year_start, self.year_end)
+        self.retrieval_workers = self.config["retrieval_workers"]
 
         # create main and constraint parts generation instance
         self.mainconstraint = MainConstraintGeneration(config, self.clocq)
@@ -65,10 +71,20 @@ class PseudoQuestionGeneration:
         # create main and constraint concatenation instance
         self.concatenate = MainConstraintConcatenate(config)
 
+        # steps are skipped if their inputs and config did not change since an earlier run
+        self.stage_runner = StageRunner(config)
+
         self.pseudo_questions = {}
         self.text_centric_questions = {}
         self.kb_centric_questions = {}
 
+        # the state after each iteration is stored in a checkpoint,
+        # such that an interrupted run can be continued after the last completed iteration
+        self.checkpoint_path = os.path.join(self.output_dir, self.config["checkpoint_file"])
+        self.resume_from_checkpoint = self.config["resume_from_checkpoint"]
+        # topic entities added in this year range
+        self.range_topic_entities = []
+
     def sample_statement_for_generation(self, generated_question_file):
 
         with open(generated_question_file, "r") as fin:
@@ -103,6 +119,8 @@ class PseudoQuestionGeneration:
 
     def question_generate_iterative(self):
         iterative_number = 0
+        if self.resume_from_checkpoint:
+            iterative_number = self._load_checkpoint()
         # Iteratively generate pseudo-questions
         # The program terminates when the number of generated pseudo-questions is equal the target number,
         # and the number of the text centric questions is equal to the target number of text centric questions.
@@ -111,10 +129,12 @@ class PseudoQuestionGeneration:
         while (len(self.pseudo_questions) < int(self.target_question_number)) and iterative_number < MAX_ITERATION:
             self.logger.info(f"iterative_number: {iterative_number}")
             start = time.time()
-            results = self.question_generate_pipeline(iterative_number)
+            with self.tracer.span("iteration", year_start=self.year_start, iterative_number=iterative_number):
+                results = self.question_generate_pipeline(iterative_number)
             if results:
                 self.pseudo_questions.update(results[0])
                 self.topic_entities += results[1]
+                self.range_topic_entities += results[1]
                 kb_central_questions, text_central_questions = self.kb_text_central(results[0])
                 self.text_centric_questions.update(text_central_questions)
                 self.kb_centric_questions.update(kb_central_questions)
@@ -126,6 +146,7 @@ class PseudoQuestionGeneration:
             self.logger.info(f"Time taken for one iteration ({iterative_number}): {time.time() - start} seconds")
             self.logger.info(f"Rerun the pipeline for this iteration {iterative_number}.")
             iterative_number += 1
+            self._store_checkpoint(iterative_number)
 
         pseudo_question_entity_file = os.path.join(self.output_dir, f'topic_entities_iteration.txt')
         with open(pseudo_question_entity_file, 'w') as fo:
@@ -139,6 +160,47 @@ class PseudoQuestionGeneration:
 
         self.entity_retriever.store_dump()
 
+    def _store_checkpoint(self, iterative_number):
+        """
+        Store the state after the given number of completed iterations.
+        The caches are flushed first, such that the checkpoint never refers to results missing on disk.
+        """
+        self.entity_retriever.store_dump()
+        self.wp_retriever.store_dump()
+        self.wp_retriever.entity_metadata.store_cache()
+        checkpoint = {
+            "iterative_number": iterative_number,
+            "pseudo_questions": self.pseudo_questions,
+            "text_centric_questions": self.text_centric_questions,
+            "kb_centric_questions": self.kb_centric_questions,
+            "topic_entities": self.range_topic_entities,
+            "random_state": random.getstate(),
+        }
+        # write and replace, such that a crash never leaves a partial checkpoint
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "wb") as fp:
+            pickle.dump(checkpoint, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _load_checkpoint(self):
+        """Restore the state of the last checkpoint (if any), and return the number of the next iteration."""
+        if not os.path.isfile(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path, "rb") as fp:
+            checkpoint = pickle.load(fp)
+        self.pseudo_questions = checkpoint["pseudo_questions"]
+        self.text_centric_questions = checkpoint["text_centric_questions"]
+        self.kb_centric_questions = checkpoint["kb_centric_questions"]
+        self.range_topic_entities = checkpoint["topic_entities"]
+        # topic entities of the completed iterations are not sampled again
+        self.topic_entities += self.range_topic_entities
+        random.setstate(checkpoint["random_state"])
+        self.logger.info(f"Resuming from checkpoint at {self.checkpoint_path} "
+                         f"after {checkpoint['iterative_number']} iterations.")
+        return checkpoint["iterative_number"]
+
     def question_generate_pipeline(self, iterative_number):
         iterative_output_path = os.path.join(self.output_dir, f"i{iterative_number}")
         iterative_output_dir = Path(iterative_output_path)
@@ -161,10 +223,12 @@ class PseudoQuestionGeneration:
         merged_similar_pseudo_question_file = os.path.join(iterative_output_dir, f'pseudo_question_merge_similar.json')
 
         # sample entities
-        sampled_entity = self.entity_sampling.sample_entity_for_retrieval()
+        with self.tracer.span("step.sampling"):
+            sampled_entity = self.entity_sampling.sample_entity_for_retrieval()
         retrieve_entities = []
         for key in sampled_entity:
             retrieve_entities += sampled_entity[key]
+        self.tracer.count("entities_sampled", len(retrieve_entities))
 
         if len(retrieve_entities) == 0:
             return None
@@ -176,7 +240,15 @@ class PseudoQuestionGeneration:
                 fp.write("\n")
 
         # retrieve information snippet for the sampled entities
-        sample_entity_evidences = self.retrieve_entity_page(retrieve_entities)
+        with self.tracer.span("step.retrieval"):
+            sample_entity_evidences = self.stage_runner.run(
+                "information_snippet_retrieval", lambda: self.retrieve_entity_page(retrieve_entities),
+                input_files=[sample_entity_file,
+                             os.path.join(self.data_path, self.config["path_to_explicit_signals"])],
+                config_keys=["source", "max_non_date_entity_in_text", "reference_time", "reference_end_time",
+                             "wikipedia_text_from_html", "temporal_annotation_require_dates", "spacy_model",
+                             "wikipedia_page_source", "clocq_use_api", "clocq_host", "clocq_p"],
+                params={"year_start": self.year_start, "year_end": self.year_end})
 
         # store the retrieval results
         with open(entity_information_file, 'w') as fp:
@@ -185,9 +257,16 @@ class PseudoQuestionGeneration:
                 fp.write("\n")
 
         # construct main and constraint
-        main_parts, constraint_parts, similar_main_questions = self.mainconstraint.main_constraint_generation(
-            entity_information_file,
-            self.entity_sampling.year_evidence_file, iterative_number)
+        with self.tracer.span("step.main_constraint_generation"):
+            main_parts, constraint_parts, similar_main_questions = self.stage_runner.run(
+                "main_constraint_generation",
+                lambda: self.mainconstraint.main_constraint_generation(entity_information_file,
+                                                                       self.entity_sampling.year_evidence_file,
+                                                                       iterative_number),
+                input_files=[entity_information_file, self.entity_sampling.year_evidence_file],
+                config_keys=["similar_threshold", "text_similar_threshold", "MIN_DATE", "MAX_DATE",
+                             "embedding_cache_dtype", "spacy_model"],
+                params={"iterative_number": iterative_number, "model": self.mainconstraint.model_name})
         with open(main_part_file, "w") as fm:
             fm.write(json.dumps(main_parts, indent=4))
 
@@ -198,9 +277,18 @@ class PseudoQuestionGeneration:
             fm.write(json.dumps(similar_main_questions, indent=4))
 
         # concatenate main and constraint
-        pseudo_questions = self.concatenate.concatenate_main_constraint_semantic_base(temporal_sequence_main_part_file,
-                                                                                      constraint_part_file)
+        with self.tracer.span("step.concatenation"):
+            pseudo_questions = self.stage_runner.run(
+                "main_constraint_concatenation",
+                lambda: self.concatenate.concatenate_main_constraint_semantic_base(temporal_sequence_main_part_file,
+                                                                                   constraint_part_file),
+                input_files=[temporal_sequence_main_part_file, constraint_part_file],
+                config_keys=["max_pseudo_question_length", "spacy_model"])
         pseudo_questions_entities = list(pseudo_questions.keys())
+        # claimed entities without pseudo-questions can be sampled again (as without processes),
+        # the others stay claimed (added to the topic entities below)
+        self.entity_sampling.release(entity["id"] for entity in retrieve_entities
+                                     if entity["id"] not in pseudo_questions)
 
         with open(pseudo_question_entity_file, 'w') as fp:
             for entity in pseudo_questions_entities:
@@ -214,6 +302,8 @@ class PseudoQuestionGeneration:
 
         with open(merged_similar_pseudo_question_file, 'w') as fout:
             fout.write(json.dumps(merged_pseudo_questions, indent=4))
+        self.tracer.count("pseudo_questions_emitted",
+                          sum(len(questions) for questions in merged_pseudo_questions.values()))
 
         return [merged_pseudo_questions, pseudo_questions_entities]
 
@@ -278,8 +368,15 @@ class PseudoQuestionGeneration:
     def retrieve_entity_page(self, sample_entities):
         start = time.time()
         sample_entity_evidences = []
-        for entity in sample_entities:
-            evidences = self.entity_retriever.retrieve_evidences_from_heterogeneous_sources(entity)
+        # entities are retrieved concurrently, results are kept in the order of the sampled entities
+        # the spans of the entities (in the worker threads) are nested in the span of the retrieval
+        entity_evidences = fetch_concurrently(self.tracer.bind(self._retrieve_entity_evidences),
+                                              sample_entities, self.retrieval_workers)
+        for evidences in entity_evidences:
             sample_entity_evidences += evidences
         print("Time consumed", time.time() - start)
         return sample_entity_evidences
+
+    def _retrieve_entity_evidences(self, entity):
+        with self.tracer.span("entity", entity=entity["id"]):
+            return self.entity_retriever.retrieve_evidences_from_heterogeneous_sources(entity)
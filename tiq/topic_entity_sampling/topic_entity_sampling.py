@@ -1,9 +1,11 @@
 import json
 import os
 import random
+import shutil
 
 from tqdm import tqdm
 
+from tiq.library.topic_entity_registry import TopicEntityRegistry
 from tiq.library.utils import get_logger
 
 
@@ -29,6 +31,7 @@ class TopicEntitySampling:
 
         self.domain_coverage = self.config["domain_coverage"]
         # already sampled entity from the pool
+        # (a topic entity registry if the year ranges are processed in parallel)
         self.sampled_topic_entities = sampled_topic_entities
         self.output_dir = output_dir
 
@@ -57,7 +60,8 @@ class TopicEntitySampling:
             year_evidence_entity_pages[year].append(file)
 
         # merge year page evidences as constraint
-        with open(year_evidence_file, "w") as fin:
+        # the year files are concatenated as they are: each line is already one json-encoded evidence
+        with open(year_evidence_file, "wb") as fin:
             year_range = []
             for year in range(self.year_start, self.year_end + 1 + self.overlap_years):
                 if year in year_evidence_entity_pages:
@@ -66,17 +70,13 @@ class TopicEntitySampling:
                     year_range.append(year)
                     for file in files:
                         if file.endswith(".jsonl"):
-                            with open(os.path.join(self.year_page_out_dir, file), "r") as fp:
-                                for line in tqdm(fp):
-                                    evidence = json.loads(line)
-                                    fin.write(json.dumps(evidence))
-                                    fin.write("\n")
+                            self._append_lines(os.path.join(self.year_page_out_dir, file), fin)
 
             self.logger.info(f"year range as temporal constraint: {year_range}")
 
         # merge entities in year page for sampling pool
         year_range = []
-        year_entity_info = []
+        year_entity_info = {}
         for year in range(self.year_start, self.year_end + 1):
             # don't overlap years for entity pool
             files = year_evidence_entity_pages[year]
@@ -86,18 +86,28 @@ class TopicEntitySampling:
                     with open(os.path.join(self.year_page_out_dir, file), 'r') as fin:
                         data = json.load(fin)
                         for item in data:
-                            if item not in year_entity_info:
-                                year_entity_info.append(item)
+                            # keep the first occurrence of each entity
+                            if item["id"] not in year_entity_info:
+                                year_entity_info[item["id"]] = item
 
         self.logger.info(f"year range as temporal constraint and for entity samping: {year_range}")
         self.logger.info(f"Number of entities for samping: {len(year_entity_info)}")
         # sort year entity
-        entity_info_sort = sorted(year_entity_info, key=lambda x: x['frequency'], reverse=True)
+        entity_info_sort = sorted(year_entity_info.values(), key=lambda x: x['frequency'], reverse=True)
         with open(year_pages_entities_info_dump, 'w') as fp:
             fp.write(json.dumps(entity_info_sort, indent=4))
 
         return entity_info_sort
 
+    def _append_lines(self, path, fout):
+        """Append the content of the file, making sure that it ends with a line break."""
+        with open(path, "rb") as fp:
+            shutil.copyfileobj(fp, fout)
+            if fp.tell() > 0:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1) != b"\n":
+                    fout.write(b"\n")
+
     def split_entities(self, long_tail_entity_threshold, prominent_entity_threshold):
         # split entities into three sets according to their frequency
         long_tail_entities = []
@@ -164,32 +174,49 @@ class TopicEntitySampling:
             other_ratio = float(self.ratio_of_sample["other"])
             portion.append(other_ratio)
 
+        # entities sampled in earlier iterations are not sampled again
+        sampled_topic_entities = set(self.sampled_topic_entities)
         if "long" in self.ratio_of_sample:
             long_sample_portions = int(self.sample_size / sum(portion) * long_ratio)
             self.long_tail_entities_for_sample = [item for item in self.long_tail_entities if
-                                                  item["id"] not in self.sampled_topic_entities]
-            sample_long_tail_entity = self.sample_from_types(self.long_tail_entities_for_sample,
-                                                             min(len(self.long_tail_entities_for_sample),
-                                                                 long_sample_portions))
+                                                  item["id"] not in sampled_topic_entities]
+            sample_long_tail_entity = self.claim(self.sample_from_types(self.long_tail_entities_for_sample,
+                                                                        min(len(self.long_tail_entities_for_sample),
+                                                                            long_sample_portions)))
             sampled_entity["long"] = sample_long_tail_entity
             self.logger.info(f"number of long tail entities: {len(sample_long_tail_entity)}")
         if "prominent" in self.ratio_of_sample:
             prominent_sample_portions = int(self.sample_size / sum(portion) * prominent_ratio)
             self.prominent_entities_for_sample = [item for item in self.prominent_entities if
-                                                  item["id"] not in self.sampled_topic_entities]
-            sample_prominent_entity = self.sample_from_types(self.prominent_entities_for_sample,
-                                                             min(len(self.prominent_entities_for_sample),
-                                                                 prominent_sample_portions))
+                                                  item["id"] not in sampled_topic_entities]
+            sample_prominent_entity = self.claim(self.sample_from_types(self.prominent_entities_for_sample,
+                                                                        min(len(self.prominent_entities_for_sample),
+                                                                            prominent_sample_portions)))
             sampled_entity["prominent"] = sample_prominent_entity
             self.logger.info(f"number of prominent entities: {len(sample_prominent_entity)}")
         if "other" in self.ratio_of_sample:
             other_sample_portions = int(self.sample_size / sum(portion) * other_ratio)
             self.other_entities_for_sample = [item for item in self.other_entities if
-                                              item["id"] not in self.sampled_topic_entities]
-            sampled_other_entity = self.sample_from_types(self.other_entities_for_sample,
-                                                          min(len(self.other_entities_for_sample),
-                                                              other_sample_portions))
+                                              item["id"] not in sampled_topic_entities]
+            sampled_other_entity = self.claim(self.sample_from_types(self.other_entities_for_sample,
+                                                                     min(len(self.other_entities_for_sample),
+                                                                         other_sample_portions)))
             sampled_entity["other"] = sampled_other_entity
             self.logger.info(f"number of other entities: {len(sampled_other_entity)}")
 
         return sampled_entity
+
+    def claim(self, sampled_entities):
+        """
+        Claim the sampled entities in the topic entity registry (if any), and return those
+        not sampled by another process in the meantime.
+        """
+        if not isinstance(self.sampled_topic_entities, TopicEntityRegistry):
+            return sampled_entities
+        claimed = set(self.sampled_topic_entities.claim(entity["id"] for entity in sampled_entities))
+        return [entity for entity in sampled_entities if entity["id"] in claimed]
+
+    def release(self, entity_ids):
+        """Release the claimed entities with the given ids, such that they can be sampled again."""
+        if isinstance(self.sampled_topic_entities, TopicEntityRegistry):
+            self.sampled_topic_entities.release(entity_ids)
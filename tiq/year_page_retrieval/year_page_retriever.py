@@ -3,6 +3,7 @@ import os
 import re
 import time
 
+from tiq.library.tracing import get_tracer
 from tiq.library.utils import get_logger
 # year page retrieval
 from tiq.year_page_retrieval.year_event_retriever import YearEventRetriever
@@ -16,34 +17,57 @@ class YearPageRetrieval:
         # load config
         self.config = config
         self.logger = get_logger(__name__, config)
+        self.tracer = get_tracer(config)
 
         self.data_path = self.config["data_path"]
         self.year_page_out_dir = year_page_out_dir
         self.year_start = self.config["year_start"]
         self.year_end = self.config["year_end"]
         self.year_month_page_link_pool = year_month_page_link_pool
+        # number of years whose pages are downloaded together
+        self.fetch_year_batch = self.config["page_fetch_year_batch"]
 
         self.wp_retriever = wp_retriever
         self.clocq = self.wp_retriever.clocq
+        self.entity_metadata = self.wp_retriever.entity_metadata
         self.year_retriever = YearEventRetriever(config, self.wp_retriever)
 
     def retrieve_page_per_year(self):
         # For the urls pool, retrieve the information from the text. Note that for each year, there can be multiple urls including months in the year.
         # The information is stored in the year granularity. All months of a year information is stored in the year json file.
+        pending_years = []
         for year in range(self.year_start, self.year_end + 1):
-            self.year_range_pages_per_year = self.year_month_page_link_pool[year]
-            self.year_evidence_file = os.path.join(self.year_page_out_dir, f'{year}_yearpages.jsonl')
-            self.year_pages_entities_info_dump = os.path.join(self.year_page_out_dir,
-                                                              f'{year}_yearpages_entity_label_type_frequency.json')
-
+            year_evidence_file, year_pages_entities_info_dump = self._year_files(year)
             # skip the retrieval if the file already exists
-            if os.path.exists(self.year_evidence_file) and os.path.exists(self.year_pages_entities_info_dump):
+            if os.path.exists(year_evidence_file) and os.path.exists(year_pages_entities_info_dump):
                 self.logger.info(f"year information exist {year}")
                 continue
+            pending_years.append(year)
+
+        # The pages of several years are downloaded concurrently,
+        # the annotation and storing is then done year by year in a fixed order.
+        for i in range(0, len(pending_years), self.fetch_year_batch):
+            batch_years = pending_years[i:i + self.fetch_year_batch]
+            batch_pages = [page for year in batch_years for page in self.year_month_page_link_pool[year]]
+            with self.tracer.span("prefetch", years=len(batch_years), pages=len(batch_pages)):
+                self.wp_retriever.prefetch_pages(batch_pages)
+
+            for year in batch_years:
+                self.year_range_pages_per_year = self.year_month_page_link_pool[year]
+                self.year_evidence_file, self.year_pages_entities_info_dump = self._year_files(year)
+                with self.tracer.span("year", year=year):
+                    entity_info_sort = self.retrieve_year_page(self.year_range_pages_per_year,
+                                                               self.year_evidence_file,
+                                                               self.year_pages_entities_info_dump)
+                self.logger.info(f"length of entity pool for sampling: {str(len(entity_info_sort))}")
+
+            self.wp_retriever.clear_prefetched_pages()
 
-            entity_info_sort = self.retrieve_year_page(self.year_range_pages_per_year, self.year_evidence_file,
-                                                       self.year_pages_entities_info_dump)
-            self.logger.info(f"length of entity pool for sampling: {str(len(entity_info_sort))}")
+    def _year_files(self, year):
+        year_evidence_file = os.path.join(self.year_page_out_dir, f'{year}_yearpages.jsonl')
+        year_pages_entities_info_dump = os.path.join(self.year_page_out_dir,
+                                                     f'{year}_yearpages_entity_label_type_frequency.json')
+        return year_evidence_file, year_pages_entities_info_dump
 
     def retrieve_year_page(self, range_pages, year_evidence_file, year_pages_entities_info_dump):
         # retrieve year pages' texts
@@ -69,13 +93,17 @@ class YearPageRetrieval:
         # information of entities in year pages: qid, label, types, and frequency
         entities = []
         entity_info = []
+        # look up frequencies and types of all entities at once
+        qids = [item["id"] for item in year_page_entities if "id" in item and ENT_PATTERN.match(item["id"])]
+        frequencies = self.entity_metadata.get_frequency_bulk(qids)
+        entity_types = self.entity_metadata.get_types_bulk(qids)
         for item in year_page_entities:
             if "id" in item:
                 if ENT_PATTERN.match(item["id"]) and item not in entities:
                     # frequency of an entity
-                    frequency = sum(self.clocq.get_frequency(item["id"]))
+                    frequency = sum(frequencies[item["id"]])
                     label = item["label"]
-                    types = self.clocq.get_types(item["id"])
+                    types = entity_types[item["id"]]
                     # entity should have types
                     if types:
                         info = {"id": item["id"], "label": label, "type": types, "frequency": frequency}